@@ -3,7 +3,7 @@ from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.pool import NullPool
 
 
-def get_database_connection(db_type, user, password, host, database):
+def get_database_connection(db_type, user, password, host, database, pool_size=5, max_overflow=10):
     try:
         if db_type == "postgresql":
             connection_string = f'postgresql+psycopg2://{user}:{password}@{host}/{database}'
@@ -13,7 +13,7 @@ def get_database_connection(db_type, user, password, host, database):
             raise ValueError("Unsupported Database Type.")
 
         # Create an engine with connection pooling (NullPool is used for no pooling, but can be customized)
-        engine = create_engine(connection_string, pool_pre_ping=True, pool_size=5, max_overflow=10)
+        engine = create_engine(connection_string, pool_pre_ping=True, pool_size=pool_size, max_overflow=max_overflow)
 
         return engine
 
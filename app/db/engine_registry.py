@@ -0,0 +1,229 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+from app.db.schema_cache import invalidate_schema
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Engines kept open at the same time
+MAX_ENGINES = int(os.getenv("MAX_ENGINES", "20"))
+
+# Upper bound on pool_size + max_overflow summed over all engines
+MAX_TOTAL_CONNECTIONS = int(os.getenv("MAX_TOTAL_CONNECTIONS", "200"))
+
+# Seconds an engine may go unused before its pool is disposed
+ENGINE_IDLE_TIMEOUT = float(os.getenv("ENGINE_IDLE_TIMEOUT", "1800"))
+
+
+def _checked_out(engine):
+    checkedout = getattr(engine.pool, "checkedout", None)
+    return checkedout() if checkedout else 0
+
+
+def _idle(record):
+    return record["in_use"] == 0 and _checked_out(record["engine"]) == 0
+
+
+class EngineRegistry:
+    """
+    Engines of all connected databases, keyed by connection ID, with LRU eviction
+    of idle engines and a cap on the connections their pools may open in total.
+
+    Requests acquire an engine and release it when they are done. An engine removed
+    while requests still use it is only disposed once the last of them released it.
+    """
+
+    def __init__(self, max_engines=MAX_ENGINES, max_total_connections=MAX_TOTAL_CONNECTIONS, idle_timeout=ENGINE_IDLE_TIMEOUT):
+        self.max_engines = max_engines
+        self.max_total_connections = max_total_connections
+        self.idle_timeout = idle_timeout
+        self._records = OrderedDict()
+        # Removed engines still in use by requests, disposed when they are released
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _capacity(self):
+        return sum(record["pool_size"] + record["max_overflow"] for record in self._records.values())
+
+    def _dispose(self, connection_id):
+        record = self._records.pop(connection_id)
+        invalidate_schema(record["engine"])
+
+        if record["in_use"]:
+            self._retired[connection_id] = record
+            logger.info(f"Removed connection {connection_id}, its engine is disposed after {record['in_use']} requests finished.")
+            return
+
+        record["engine"].dispose()
+        logger.info(f"Disposed engine for connection {connection_id}.")
+
+    def _evict_idle(self, now):
+        for connection_id, record in list(self._records.items()):
+            if now - record["last_used"] >= self.idle_timeout and _idle(record):
+                self._dispose(connection_id)
+
+    def _evict_lru(self):
+        """
+        Dispose the least recently used engine no request is using.
+        Returns False when every engine is busy.
+        """
+        for connection_id, record in self._records.items():
+            if _idle(record):
+                self._dispose(connection_id)
+                return True
+        return False
+
+    def register(self, engine, pool_size, max_overflow):
+        """
+        Register an engine and return its connection ID. Connecting again with the same
+        URL and pool settings returns the existing ID and disposes the new engine.
+
+        Raises:
+            HTTPException: 503 when the caps are reached and no engine is idle.
+        """
+        key = (engine.url.render_as_string(hide_password=False), pool_size, max_overflow)
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_idle(now)
+
+            for connection_id, record in self._records.items():
+                if record["key"] == key:
+                    engine.dispose()
+                    record["last_used"] = now
+                    self._records.move_to_end(connection_id)
+                    return connection_id
+
+            while self._records and (
+                len(self._records) >= self.max_engines
+                or self._capacity() + pool_size + max_overflow > self.max_total_connections
+            ):
+                if not self._evict_lru():
+                    break
+
+            if len(self._records) >= self.max_engines or (
+                self._capacity() + pool_size + max_overflow > self.max_total_connections
+            ):
+                engine.dispose()
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Too many open database connections. Please try again later.",
+                )
+
+            connection_id = uuid.uuid4().hex
+            self._records[connection_id] = {
+                "engine": engine,
+                "key": key,
+                "pool_size": pool_size,
+                "max_overflow": max_overflow,
+                "created_at": time.time(),
+                "last_used": now,
+                "requests": 0,
+                "in_use": 0,
+            }
+            return connection_id
+
+    def acquire(self, connection_id):
+        """
+        Return the engine of a connection ID, or None when it is unknown or was evicted.
+        The engine is not disposed until release() was called for it.
+        """
+        with self._lock:
+            self._evict_idle(time.monotonic())
+
+            record = self._records.get(connection_id)
+            if record is None:
+                return None
+
+            record["last_used"] = time.monotonic()
+            record["requests"] += 1
+            record["in_use"] += 1
+            self._records.move_to_end(connection_id)
+            return record["engine"]
+
+    def release(self, connection_id):
+        with self._lock:
+            record = self._records.get(connection_id) or self._retired.get(connection_id)
+            if record is None:
+                return
+
+            record["in_use"] -= 1
+            # Idle timeouts count from the end of the last request
+            record["last_used"] = time.monotonic()
+
+            if not record["in_use"] and self._retired.pop(connection_id, None) is not None:
+                record["engine"].dispose()
+                logger.info(f"Disposed engine for connection {connection_id}.")
+
+    @contextmanager
+    def lease(self, connection_id):
+        """
+        Acquire the engine of a connection ID for the duration of a with block.
+        Yields None when the connection ID is unknown or was evicted.
+        """
+        engine = self.acquire(connection_id)
+        try:
+            yield engine
+        finally:
+            if engine is not None:
+                self.release(connection_id)
+
+    def remove(self, connection_id):
+        with self._lock:
+            if connection_id not in self._records:
+                return False
+            self._dispose(connection_id)
+            return True
+
+    def dispose_all(self):
+        with self._lock:
+            for connection_id in list(self._records):
+                self._dispose(connection_id)
+            # On shutdown engines still in use are disposed as well
+            for record in self._retired.values():
+                record["engine"].dispose()
+            self._retired.clear()
+
+    def stats(self, connection_id):
+        """
+        Return the pool statistics of one connection, or None when it is unknown or was evicted.
+        Only clients knowing a connection ID can see it, the IDs of other clients are never listed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+
+            record = self._records.get(connection_id)
+            if record is None:
+                return None
+
+            engine = record["engine"]
+            pool = engine.pool
+            return {
+                "connection_id": connection_id,
+                "url": engine.url.render_as_string(hide_password=True),
+                "dialect": engine.dialect.name,
+                "pool_size": record["pool_size"],
+                "max_overflow": record["max_overflow"],
+                "checked_out": _checked_out(engine),
+                "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+                "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+                "pool_status": pool.status(),
+                "requests": record["requests"],
+                "in_use": record["in_use"],
+                "created_at": record["created_at"],
+                "idle_seconds": round(now - record["last_used"], 1),
+            }
+
+
+engine_registry = EngineRegistry()
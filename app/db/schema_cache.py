@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+from dotenv import load_dotenv
+from langchain.sql_database import SQLDatabase
+from sqlalchemy import text
+
+from app.utils.schema_index import SchemaIndex
+from app.utils.sql_utils import build_column_index, get_database_schema
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Hard upper bound on how long a reflected schema is trusted, in seconds
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "3600"))
+
+# How often the cheap catalog signature query is allowed to run, in seconds
+SCHEMA_CHECK_INTERVAL = float(os.getenv("SCHEMA_CHECK_INTERVAL", "30"))
+
+# One-row queries that change whenever a table, column or key is added, dropped or altered
+CATALOG_SIGNATURE_QUERIES = {
+    "postgresql": """
+        SELECT md5(
+            (SELECT string_agg(c.relname || '.' || a.attname || ':' || a.atttypid::text || ':' || a.attnotnull::text,
+                               ',' ORDER BY c.relname, a.attnum)
+             FROM pg_catalog.pg_attribute a
+             JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+             JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+             WHERE n.nspname = current_schema()
+               AND c.relkind IN ('r', 'p')
+               AND a.attnum > 0
+               AND NOT a.attisdropped)
+            || '|' ||
+            coalesce((SELECT string_agg(con.conname || ':' || con.contype || ':' || con.conrelid::text,
+                                        ',' ORDER BY con.conname, con.conrelid)
+                      FROM pg_catalog.pg_constraint con
+                      JOIN pg_catalog.pg_namespace n ON n.oid = con.connamespace
+                      WHERE n.nspname = current_schema() AND con.contype IN ('p', 'f')), '')
+        )
+    """,
+    "mysql": """
+        SELECT CONCAT(COUNT(*), ':', BIT_XOR(CRC32(CONCAT_WS('.', TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY))))
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE()
+    """,
+}
+
+
+class CachedSQLDatabase(SQLDatabase):
+    """
+    LangChain SQLDatabase that memoizes get_table_info, so the table DDL and sample rows
+    are built once per schema version instead of on every chain invocation.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._table_info_cache = {}
+        self._table_info_lock = threading.Lock()
+
+    def get_table_info(self, table_names=None):
+        key = tuple(sorted(table_names)) if table_names else None
+
+        with self._table_info_lock:
+            if key in self._table_info_cache:
+                return self._table_info_cache[key]
+
+        table_info = super().get_table_info(table_names)
+
+        with self._table_info_lock:
+            self._table_info_cache[key] = table_info
+
+        return table_info
+
+
+@dataclass
+class SchemaEntry:
+    """
+    Everything derived from one reflection of a database catalog.
+    """
+
+    schema: dict
+    column_index: dict
+    schema_index: SchemaIndex
+    db: SQLDatabase
+    fingerprint: str
+    catalog_signature: str | None
+    loaded_at: float = field(default_factory=time.monotonic)
+    checked_at: float = field(default_factory=time.monotonic)
+
+
+_entries = {}
+_entries_lock = threading.Lock()
+_engine_locks = {}
+
+
+def _engine_lock(engine):
+    with _entries_lock:
+        return _engine_locks.setdefault(engine, threading.Lock())
+
+
+def get_catalog_signature(engine):
+    """
+    Run the cheap catalog signature query for the engine's dialect.
+    Returns None when the dialect has no signature query or the query fails.
+    """
+    query = CATALOG_SIGNATURE_QUERIES.get(engine.dialect.name)
+    if query is None:
+        return None
+
+    try:
+        with engine.connect() as connection:
+            return str(connection.execute(text(query)).scalar())
+    except Exception as e:
+        logger.warning(f"Catalog signature check failed, falling back to TTL only: {str(e)}")
+        return None
+
+
+def _schema_fingerprint(schema):
+    payload = json.dumps(schema, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _load_entry(engine, catalog_signature):
+    started = time.perf_counter()
+
+    schema = get_database_schema(engine)
+    # Lazy reflection: LangChain only reflects the tables it is asked to describe
+    db = CachedSQLDatabase(engine, lazy_table_reflection=True)
+
+    logger.info(
+        f"Reflected schema with {len(schema)} tables in {time.perf_counter() - started:.3f}s."
+    )
+    return SchemaEntry(
+        schema=schema,
+        column_index=build_column_index(schema),
+        schema_index=SchemaIndex(schema),
+        db=db,
+        fingerprint=_schema_fingerprint(schema),
+        catalog_signature=catalog_signature,
+    )
+
+
+def get_schema_entry(engine, force_refresh=False):
+    """
+    Return the cached schema entry for the engine, reflecting the catalog only when
+    there is no entry yet, the TTL has expired, the catalog signature has changed
+    or a refresh is forced.
+    """
+    with _engine_lock(engine):
+        entry = _entries.get(engine)
+        now = time.monotonic()
+
+        if entry is not None and not force_refresh:
+            if now - entry.loaded_at < SCHEMA_CACHE_TTL:
+                if now - entry.checked_at < SCHEMA_CHECK_INTERVAL:
+                    return entry
+
+                signature = get_catalog_signature(engine)
+                entry.checked_at = now
+                if signature is None or signature == entry.catalog_signature:
+                    return entry
+
+                logger.info("Catalog signature changed, reflecting schema again.")
+            else:
+                logger.info("Schema cache entry expired, reflecting schema again.")
+
+        entry = _load_entry(engine, get_catalog_signature(engine))
+        _entries[engine] = entry
+        return entry
+
+
+def refresh_schema(engine):
+    """
+    Force a new reflection of the engine's catalog and return the fresh entry.
+    """
+    return get_schema_entry(engine, force_refresh=True)
+
+
+def invalidate_schema(engine):
+    """
+    Drop the cached schema of an engine, e.g. when the engine is disposed.
+    """
+    with _entries_lock:
+        _entries.pop(engine, None)
+        _engine_locks.pop(engine, None)
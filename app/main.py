@@ -1,11 +1,30 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from app.db.engine_registry import engine_registry
 from app.routes.api import router
+from app.services.job_queue import job_queue
+from app.services.llm_gateway import close_http_clients
+from app.services.render_pool import render_pool
 import os, sys
 from fastapi.middleware.cors import CORSMiddleware
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start the plot rendering workers before serving, so the first request does not pay for it
+    await run_in_threadpool(render_pool.start)
+    job_queue.start()
+    yield
+    await job_queue.stop()
+    render_pool.shutdown()
+    engine_registry.dispose_all()
+    await close_http_clients()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -0,0 +1,17 @@
+import os
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, Field
+
+load_dotenv()
+
+# Largest batch accepted in one request, and the upper bound for the per-request concurrency limits
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+
+
+class BatchQuestionRequest(BaseModel):
+    questions: list[str] = Field(min_length=1, max_length=BATCH_MAX_QUESTIONS)
+    # Concurrent LLM calls and concurrent SQL queries, the server defaults are used when omitted
+    llm_concurrency: int | None = Field(None, ge=1, le=BATCH_MAX_CONCURRENCY)
+    db_concurrency: int | None = Field(None, ge=1, le=BATCH_MAX_CONCURRENCY)
@@ -1,19 +1,46 @@
 from app.db.connections import get_database_connection
+from app.db.engine_registry import engine_registry
+from app.db.schema_cache import refresh_schema
 from app.services.query_chain import (
     generate_sql_and_execute,
-    generate_plot_code_from_ai,
+    plot_code_cache,
+    sql_cache,
 )
-from app.services.visualization_service import execute_plot_code
-from fastapi import APIRouter, Depends
+from app.models.batch import BatchQuestionRequest
+from app.services.batch_service import answer_questions
+from app.services.job_queue import JOB_DEFAULT_PRIORITY, JOB_PRIORITY_LEVELS, job_queue
+from app.services.llm_cache import llm_cache
+from app.services.query_service import open_sql_stream, result_cache, stream_sql_as_ndjson
+from app.services.visualization_pipeline import image_cache, run_visualization_pipeline, visualization_events
+from fastapi import APIRouter, Depends, Header, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi import HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+import json
 import logging
-
-from app.utils.sql_utils import convert_decimal_to_float
+from contextlib import contextmanager
+from functools import partial
+
+from app.utils.columnar import ColumnarResult
+from app.utils.image_options import (
+    IMAGE_DEFAULT_DPI,
+    IMAGE_MAX_DPI,
+    IMAGE_MAX_PIXELS,
+    IMAGE_MEDIA_TYPES,
+    IMAGE_MIN_DPI,
+    ImageOptions,
+)
+from app.utils.metrics import record_coalesced
+from app.utils.single_flight import SingleFlight
 from app.utils.sql_utils import create_readonly_user
 
 router = APIRouter()
 
+# In-flight requests, keyed by connection, exact question text and endpoint
+request_flights = SingleFlight()
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)  # Set logging level to INFO or DEBUG as needed
 
@@ -24,79 +51,305 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
-def get_engine():
-    return engineGlobal
+def get_connection_id(connection_id: str | None = None, x_connection_id: str | None = Header(None)):
+    return connection_id or x_connection_id
+
+
+def get_image_options(
+    image_format: str = Query("png", alias="format"),
+    dpi: int = Query(IMAGE_DEFAULT_DPI, ge=IMAGE_MIN_DPI, le=IMAGE_MAX_DPI),
+    width: int | None = Query(None, ge=1, le=IMAGE_MAX_PIXELS),
+    height: int | None = Query(None, ge=1, le=IMAGE_MAX_PIXELS),
+):
+    image_format = image_format.lower()
+    image_format = {"jpg": "jpeg"}.get(image_format, image_format)
+    if image_format not in IMAGE_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400, detail=f"Unsupported image format, expected one of {', '.join(IMAGE_MEDIA_TYPES)}."
+        )
+    return ImageOptions(image_format, dpi, width, height)
+
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match holds a list of quoted, possibly weak, ETags or "*"
+    tags = [tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def get_engine(connection_id=Depends(get_connection_id)):
+    # Every client names its own connection, falling back to another client's database is never right
+    if not connection_id:
+        raise HTTPException(
+            status_code=400, detail="Missing connection ID. Send the connection_id returned by /connect_db."
+        )
+
+    engine = engine_registry.acquire(connection_id)
+    if engine is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired connection ID. Please connect to the database again.")
+
+    # Released after the response was sent, so streamed responses keep the engine until they finished
+    try:
+        yield engine
+    finally:
+        engine_registry.release(connection_id)
+
+
+@contextmanager
+def shared_run_lease(connection_id):
+    # A coalesced run keeps going after the request that started it disconnected and released
+    # its engine, so it holds its own reference until it finished
+    with engine_registry.lease(connection_id) as engine:
+        if engine is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired connection ID. Please connect to the database again.")
+        yield engine
 
 
 @router.post("/connect_db")
-async def connect_db(db_type: str, user: str, password: str, host: str, database: str):
+async def connect_db(db_type: str, user: str, password: str, host: str, database: str, pool_size: int = 5, max_overflow: int = 10):
     try:
-        global engineGlobal
-        engineGlobal = get_database_connection(db_type, user, password, host, database)
+        engine = await run_in_threadpool(
+            get_database_connection, db_type, user, password, host, database, pool_size, max_overflow
+        )
+        if engine is None:
+            raise ValueError("Could not create the database engine.")
+
+        connection_id = await run_in_threadpool(engine_registry.register, engine, pool_size, max_overflow)
 
         # Create read-only user ofr llm
-        create_readonly_user(engineGlobal, database)
+        with engine_registry.lease(connection_id) as engine:
+            if engine is None:
+                raise ValueError("The database engine was evicted before it was set up.")
+            await run_in_threadpool(create_readonly_user, engine, database)
+
+        logger.info(f"Database connected successfully (connection {connection_id}).")
+        return {"message": "Database connected successfully.", "connection_id": connection_id}
 
-        logger.info("Database connected successfully.")
-        return {"message": "Database connected successfully."}
+    except HTTPException as e:
+        raise e
 
     except Exception as e:
         logger.error(f"Database connection failed: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to connect to database.")
 
 
+@router.get("/connections/{connection_id}")
+async def connection_stats(connection_id: str):
+    stats = await run_in_threadpool(engine_registry.stats, connection_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Unknown connection ID.")
+    return stats
+
+
+@router.delete("/connections/{connection_id}")
+async def close_connection(connection_id: str):
+    if not await run_in_threadpool(engine_registry.remove, connection_id):
+        raise HTTPException(status_code=404, detail="Unknown connection ID.")
+    return {"message": "Connection closed."}
+
+
+@router.post("/schema/refresh")
+async def refresh_database_schema(engine=Depends(get_engine)):
+    if not engine:
+        raise HTTPException(status_code=400, detail="Database connection is not established. Please connect to a database first.")
+
+    schema_entry = await run_in_threadpool(refresh_schema, engine)
+
+    logger.info(f"Schema refreshed: {len(schema_entry.schema)} tables.")
+    return {
+        "message": "Schema refreshed successfully.",
+        "tables": len(schema_entry.schema),
+        "fingerprint": schema_entry.fingerprint,
+    }
+
+
+@router.get("/cache/stats")
+async def cache_stats():
+    return {
+        "sql": sql_cache.stats(),
+        "result": result_cache.stats(),
+        "plot_code": plot_code_cache.stats(),
+        "image": image_cache.stats(),
+        "llm": await run_in_threadpool(llm_cache.stats) if llm_cache else None,
+    }
+
+
+@router.get("/metrics")
+async def metrics():
+    # Stage latencies, retries, LLM tokens, result sizes and cache counters in the Prometheus text format
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @router.post("/ask/")
-async def ask_question_chain(question: str, engine=Depends(get_engine)):
+async def ask_question_chain(
+    question: str, stream: bool = False, connection_id=Depends(get_connection_id), engine=Depends(get_engine)
+):
     # step 1: log after invoking the llm
     logger.info(f"Invoking Groq LLM with question: {question}")
 
-    sql_query_result = generate_sql_and_execute(question, engine)
+    if stream:
+        # The query runs once: its first chunk is checked here, the rest is streamed from the same cursor
+        sql_query_result = await generate_sql_and_execute(question, engine, execute=open_sql_stream)
 
-    # Return the successfull result
-    return {"result": sql_query_result["result"]}
+        return StreamingResponse(
+            stream_sql_as_ndjson(sql_query_result["result"]),
+            media_type="application/x-ndjson",
+        )
 
-@router.post("/code-to-visualization")
-async def code_to_visualization(question: str, engine=Depends(get_engine)):
-    # Step 1: Log after invoking the LLM for SQL generation
-    logger.info(f"Invoking Groq LLM for SQL generation with question: {question}")
-    
-    sql_result = generate_sql_and_execute(question, engine)
+    async def answer():
+        with shared_run_lease(connection_id):
+            sql_query_result = await generate_sql_and_execute(question, engine)
+        result = sql_query_result["result"]
+        return result.to_rows() if isinstance(result, ColumnarResult) else result
 
-    if not sql_result or not sql_result.get("response"):
-        logger.warning(f"No data found for the query: {question}")
-        raise HTTPException(status_code=404, detail="No data found for the query.")
+    # Identical questions arriving while one is being answered share its rows
+    key = (engine, question.strip(), "ask")
+    rows, shared = await request_flights.do(key, answer)
 
-    # Convert Decimal type float in result
-    sql_result["result"] = convert_decimal_to_float(sql_result["result"])
-    logger.info(f"SQL result (after converting Decimal): {sql_result['result']}")
+    if shared:
+        record_coalesced("ask")
 
-    # Step 2: Log SQL query and execution result
-    logger.info(f"Generated SQL query: {sql_result['response']}")
-    logger.info(f"SQL Query result: {sql_result['result']}")
+    # Return the successfull result
+    return {"result": rows}
+
+@router.post("/ask/batch")
+async def ask_batch(request: BatchQuestionRequest, engine=Depends(get_engine)):
+    logger.info(f"Received a batch of {len(request.questions)} questions.")
+
+    async def ndjson_lines():
+        # One JSON line per question, in the order the questions finish
+        async for item in answer_questions(request.questions, engine, request.llm_concurrency, request.db_concurrency):
+            yield json.dumps(jsonable_encoder(item)) + "\n"
 
-    # Step 3: Log after generating python code for visualization
-    logger.info("Generating Python code for visualization.")
-    
-    # Generate Python code for the visualization from the AI
-    plot_code = generate_plot_code_from_ai(sql_result["result"], question)
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
 
-    if not plot_code:
-        logger.error("Failed to generate python code for visualization")
-        raise HTTPException(status_code=500, detail="Failed to generate Python code for visualization.")
 
-    logger.info(f"Generated Python plot code: {plot_code}")
+async def visualize_question(question, use_templates, options, connection_id, engine):
+    async def visualize():
+        with shared_run_lease(connection_id):
+            return await run_visualization_pipeline(question, engine, use_templates, options=options)
 
-    # Step 4: Log after executing the generated plot code
-    buf = execute_plot_code(plot_code, sql_result["result"])
+    # Identical questions arriving while one is being answered share its chart
+    key = (engine, question.strip(), "code-to-visualization", use_templates, options)
+    image, shared = await request_flights.do(key, visualize)
 
-    if buf is None:
-        logger.error("Failed to generate the plot buffer.")
-        raise HTTPException(status_code=500, detail="Failed to generate the plot image.")
+    if shared:
+        record_coalesced("code-to-visualization")
 
-    logger.info("Plot generated successfully")
-    return StreamingResponse(buf, media_type="image/png")
+    return image
 
 
+@router.post("/code-to-visualization")
+async def code_to_visualization(
+    question: str,
+    use_templates: bool = True,
+    options: ImageOptions = Depends(get_image_options),
+    connection_id=Depends(get_connection_id),
+    engine=Depends(get_engine),
+):
+    image = await visualize_question(question, use_templates, options, connection_id, engine)
+
+    # The ETag is derived from the plot code, the data and the image options. Conditional
+    # requests go to the GET variant, a POST always returns the image.
+    headers = {"ETag": f'"{image.etag}"', "Cache-Control": "no-cache"}
+    return Response(content=image.content, media_type=image.media_type, headers=headers)
+
+
+@router.get("/code-to-visualization")
+async def get_visualization(
+    question: str,
+    use_templates: bool = True,
+    options: ImageOptions = Depends(get_image_options),
+    if_none_match: str | None = Header(None),
+    connection_id=Depends(get_connection_id),
+    engine=Depends(get_engine),
+):
+    image = await visualize_question(question, use_templates, options, connection_id, engine)
+
+    # An unchanged chart is not sent again
+    headers = {"ETag": f'"{image.etag}"', "Cache-Control": "no-cache"}
+    if if_none_match and etag_matches(if_none_match, image.etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=image.content, media_type=image.media_type, headers=headers)
+
+
+@router.get("/code-to-visualization/stream")
+async def code_to_visualization_stream(
+    question: str,
+    use_templates: bool = True,
+    options: ImageOptions = Depends(get_image_options),
+    engine=Depends(get_engine),
+):
+    # GET so browsers can consume the stream with EventSource
+    logger.info(f"Streaming visualization progress for question: {question}")
+
+    async def sse_events():
+        # One server-sent event per completed stage; a client disconnect closes this generator and cancels the pipeline
+        async for event, data in visualization_events(question, engine, use_templates, options):
+            yield f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+    return StreamingResponse(
+        sse_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+
+@router.post("/jobs/code-to-visualization", status_code=202)
+async def submit_visualization_job(
+    question: str,
+    use_templates: bool = True,
+    priority: int = Query(JOB_DEFAULT_PRIORITY, ge=0, lt=JOB_PRIORITY_LEVELS),
+    options: ImageOptions = Depends(get_image_options),
+    connection_id=Depends(get_connection_id),
+    engine=Depends(get_engine),
+):
+    # The job outlives this request, so it holds its own reference to the engine until it finished
+    if engine_registry.acquire(connection_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired connection ID. Please connect to the database again.")
+
+    # Returns at once, the client polls the job and fetches the image when it succeeded
+    job = job_queue.submit(
+        question, engine, use_templates, options, priority, release=partial(engine_registry.release, connection_id)
+    )
+    return {**job.to_dict(), "status_url": f"/jobs/{job.id}", "result_url": f"/jobs/{job.id}/result"}
+
+
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job ID.")
+    return job
+
+
+@router.get("/jobs/{job_id}")
+async def job_status(job=Depends(get_job)):
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}/result")
+async def job_result(job=Depends(get_job), if_none_match: str | None = Header(None)):
+    if not job.finished:
+        raise HTTPException(status_code=409, detail=f"The job is {job.status}, poll its status until it finished.")
+
+    if job.status != "succeeded":
+        raise HTTPException(status_code=job.status_code or 410, detail=job.error or "The job was cancelled.")
+
+    headers = {"ETag": f'"{job.image.etag}"', "Cache-Control": "no-cache"}
+    if if_none_match and etag_matches(if_none_match, job.image.etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=job.image.content, media_type=job.image.media_type, headers=headers)
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job ID.")
+    return job.to_dict()
+
 
 # @router.post("/code-to-visualization")
 # async def code_to_visualization(question: str, engine=Depends(get_engine)):
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from app.db.schema_cache import get_schema_entry
+from app.services.query_chain import generate_sql_and_execute
+from app.utils.columnar import ColumnarResult
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Default limits for the questions of one batch running at the same time
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+BATCH_DB_CONCURRENCY = int(os.getenv("BATCH_DB_CONCURRENCY", "4"))
+
+
+async def answer_questions(questions, engine, llm_concurrency=None, db_concurrency=None):
+    """
+    Answer a batch of questions concurrently and yield one result dictionary per question
+    as soon as it finishes, in completion order.
+
+    The schema is looked up once for the whole batch. LLM calls and query executions are
+    limited separately, so the database pool is not exhausted while the LLM is slow.
+
+    Yields:
+        dict: The question's index in the batch, the question, and either the generated
+        SQL and its rows, or the error and its HTTP status code.
+    """
+    schema_entry = await run_in_threadpool(get_schema_entry, engine)
+    llm_semaphore = asyncio.Semaphore(llm_concurrency or BATCH_LLM_CONCURRENCY)
+    db_semaphore = asyncio.Semaphore(db_concurrency or BATCH_DB_CONCURRENCY)
+
+    async def answer(index, question):
+        try:
+            sql_result = await generate_sql_and_execute(
+                question,
+                engine,
+                schema_entry=schema_entry,
+                llm_semaphore=llm_semaphore,
+                db_semaphore=db_semaphore,
+            )
+            result = sql_result["result"]
+            rows = result.to_rows() if isinstance(result, ColumnarResult) else result
+            return {"index": index, "question": question, "sql": sql_result["response"], "result": rows}
+
+        except HTTPException as e:
+            return {"index": index, "question": question, "error": e.detail, "status_code": e.status_code}
+
+        except Exception as e:
+            logger.error(f"Batch question {index} failed: {str(e)}")
+            return {"index": index, "question": question, "error": str(e), "status_code": 500}
+
+    tasks = [asyncio.create_task(answer(index, question)) for index, question in enumerate(questions)]
+    logger.info(f"Answering a batch of {len(tasks)} questions.")
+
+    try:
+        for next_answer in asyncio.as_completed(tasks):
+            yield await next_answer
+    finally:
+        # The client went away or the stream was closed early
+        for task in tasks:
+            task.cancel()
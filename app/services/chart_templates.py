@@ -0,0 +1,166 @@
+import logging
+import re
+from io import BytesIO
+
+import pandas as pd
+import seaborn as sns
+from matplotlib.figure import Figure
+
+from app.utils.columnar import ColumnarResult
+from app.utils.image_options import save_figure
+from app.utils.metrics import timed
+from app.utils.sql_utils import column_values, profile_columns
+from app.utils.visualization_utils import CHART_CONFIDENCE_THRESHOLD, chart_columns, classify_chart_type
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_CHART_TYPES = ("bar", "line", "pie", "scatter", "heatmap")
+
+# Requests the templates cannot express (filtering, other chart families, styling) go to the LLM
+LLM_ONLY_PATTERN = re.compile(
+    r"\b(exclude|excluding|except|without|histogram|box ?plot|violin|area (chart|graph|plot)s?|stacked|"
+    r"bubble|3d|choropleth|geo ?map|annotate|colou?r scheme|palette|log scale|trend ?line|regression)\b",
+    re.IGNORECASE,
+)
+
+MAX_PIE_SLICES = 8
+MAX_BAR_CATEGORIES = 50
+MAX_HEATMAP_CATEGORIES = 30
+
+
+def pick_template(result, question):
+    """
+    Pick a template chart for the chart type chosen by the heuristic classifier,
+    and the result columns to draw it with.
+
+    Returns:
+        dict: The chart type and the columns to draw, or None when no template fits
+        and the LLM code path should be used instead.
+    """
+    if not result or LLM_ONLY_PATTERN.search(question):
+        return None
+
+    chart_type, confidence = classify_chart_type(result, question)
+    if chart_type not in TEMPLATE_CHART_TYPES or confidence <= CHART_CONFIDENCE_THRESHOLD:
+        return None
+
+    time_columns, numeric, text = chart_columns(result, profile_columns(result))
+
+    if chart_type == "line" and time_columns and numeric:
+        hue = text[0]["name"] if text and text[0]["distinct"] <= 10 else None
+        return {"chart_type": "line", "x": time_columns[0], "y": [p["name"] for p in numeric], "hue": hue}
+
+    if chart_type == "heatmap" and len(text) == 2 and len(numeric) == 1:
+        if all(p["distinct"] <= MAX_HEATMAP_CATEGORIES for p in text):
+            return {"chart_type": "heatmap", "x": text[1]["name"], "y": [text[0]["name"]], "value": numeric[0]["name"]}
+
+    if chart_type == "pie" and len(text) == 1 and len(numeric) == 1 and text[0]["distinct"] <= MAX_PIE_SLICES:
+        if all(value is None or value >= 0 for value in column_values(result, numeric[0]["name"])):
+            return {"chart_type": "pie", "x": text[0]["name"], "y": [numeric[0]["name"]]}
+
+    if chart_type == "bar" and len(text) == 1 and numeric and text[0]["distinct"] <= MAX_BAR_CATEGORIES:
+        return {"chart_type": "bar", "x": text[0]["name"], "y": [p["name"] for p in numeric]}
+
+    if chart_type == "scatter" and not text and len(numeric) >= 2:
+        return {"chart_type": "scatter", "x": numeric[0]["name"], "y": [numeric[1]["name"]]}
+
+    return None
+
+
+def _apply_darkgrid(ax):
+    # Seaborn's "darkgrid" look, set on the axes instead of the global rcParams so
+    # concurrent renders in other threads are not affected
+    ax.set_facecolor("#EAEAF2")
+    ax.grid(True, color="white", linewidth=1)
+    ax.set_axisbelow(True)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+
+
+def _draw(ax, df, template):
+    chart_type = template["chart_type"]
+    x = template["x"]
+    y = template["y"]
+
+    if chart_type == "bar":
+        if len(y) == 1:
+            sns.barplot(data=df, x=x, y=y[0], estimator="sum", errorbar=None, ax=ax)
+            ax.set_ylabel(y[0])
+        else:
+            long_df = df.melt(id_vars=[x], value_vars=y, var_name="metric", value_name="value")
+            sns.barplot(data=long_df, x=x, y="value", hue="metric", estimator="sum", errorbar=None, ax=ax)
+        for container in ax.containers:
+            ax.bar_label(container, fmt="%.1f", fontsize=9)
+
+    elif chart_type == "line":
+        if len(y) == 1:
+            sns.lineplot(data=df, x=x, y=y[0], hue=template.get("hue"), marker="o", ax=ax)
+            ax.set_ylabel(y[0])
+        else:
+            long_df = df.melt(id_vars=[x], value_vars=y, var_name="metric", value_name="value")
+            sns.lineplot(data=long_df, x=x, y="value", hue="metric", marker="o", ax=ax)
+
+    elif chart_type == "pie":
+        grouped = df.groupby(x, sort=False)[y[0]].sum()
+        ax.pie(grouped.values, labels=grouped.index.astype(str), autopct="%.1f%%", startangle=90)
+        ax.axis("equal")
+
+    elif chart_type == "scatter":
+        sns.scatterplot(data=df, x=x, y=y[0], ax=ax)
+
+    elif chart_type == "heatmap":
+        pivot = df.pivot_table(index=y[0], columns=x, values=template["value"], aggfunc="sum")
+        sns.heatmap(pivot, annot=True, fmt=".3g", cmap="viridis", ax=ax)
+
+
+@timed("render_chart_template")
+def render_chart_template(result, question, template=None, options=None):
+    """
+    Render the common chart types directly from the SQL result, without asking the LLM for code.
+
+    Args:
+        result (list[dict]): The SQL result data to plot.
+        question (str): The user's natural language question, used for the title and chart hints.
+        template (dict): The template returned by pick_template, picked here when not given.
+        options (ImageOptions): Format, resolution and size of the image, a default PNG when not given.
+
+    Returns:
+        BytesIO: A buffer containing the plot image, or None when no template
+        fits the request or rendering failed.
+    """
+    if template is None:
+        template = pick_template(result, question)
+    if template is None:
+        return None
+
+    try:
+        df = result.to_dataframe() if isinstance(result, ColumnarResult) else pd.DataFrame(result)
+        for column in template["y"] + [template.get("value")]:
+            if column is not None and column in df and df[column].dtype == object:
+                df[column] = df[column].astype(float)
+
+        # Figure objects do not touch pyplot's global state, so templates can render in the API threads
+        # The tight layout is applied when the figure is saved, after it was resized to the requested size
+        fig = Figure(figsize=(12, 7), layout="tight")
+        ax = fig.add_subplot()
+        if template["chart_type"] not in ("pie", "heatmap"):
+            _apply_darkgrid(ax)
+
+        _draw(ax, df, template)
+
+        # As the user wrote it, capitalize() would lower-case names such as "Product XX" or "USA"
+        title = question.strip().rstrip("?")
+        ax.set_title(title[:1].upper() + title[1:], fontsize=14)
+        if template["chart_type"] in ("bar", "line", "heatmap"):
+            for label in ax.get_xticklabels():
+                label.set_rotation(45)
+                label.set_horizontalalignment("right")
+
+        buf = BytesIO(save_figure(fig, options))
+
+        logger.info(f"Rendered {template['chart_type']} chart from template.")
+        return buf
+
+    except Exception as e:
+        logger.warning(f"Template rendering failed, falling back to AI-generated code: {str(e)}")
+        return None
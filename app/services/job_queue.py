@@ -0,0 +1,260 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+import uuid
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+from app.services.visualization_pipeline import RenderedImage, run_visualization_pipeline
+from app.utils.cache import TTLCache
+from app.utils.image_options import DEFAULT_IMAGE_OPTIONS, ImageOptions
+from app.utils.metrics import JOB_QUEUE_DEPTH, record_job, track_stage
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Background workers running visualization jobs at the same time
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+
+# Jobs allowed to wait for a worker before new submissions are rejected
+JOB_QUEUE_MAX_DEPTH = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "100"))
+
+# Priorities run from 0 (first) to JOB_PRIORITY_LEVELS - 1 (last)
+JOB_PRIORITY_LEVELS = int(os.getenv("JOB_PRIORITY_LEVELS", "10"))
+JOB_DEFAULT_PRIORITY = int(os.getenv("JOB_DEFAULT_PRIORITY", "5"))
+
+# Seconds a job may run, and seconds a finished job and its image are kept
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "300"))
+JOB_TTL = float(os.getenv("JOB_TTL", "900"))
+
+JOB_STORE_MAX_ENTRIES = int(os.getenv("JOB_STORE_MAX_ENTRIES", "10000"))
+JOB_STORE_MAX_BYTES = int(os.getenv("JOB_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Seconds a client is asked to wait before submitting again when the queue is full
+QUEUE_FULL_RETRY_AFTER = 5
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+@dataclass
+class Job:
+    id: str
+    question: str
+    engine: object
+    use_templates: bool
+    options: ImageOptions
+    priority: int
+    status: str = "queued"
+    submitted_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    # Seconds spent waiting in the queue and in each pipeline stage, in the order they completed.
+    # A stage that runs again, e.g. plot code generated anew after cached code failed to render, adds up
+    timings: dict = field(default_factory=dict)
+    error: str | None = None
+    status_code: int | None = None
+    image: RenderedImage | None = None
+    task: asyncio.Task | None = None
+    # Called once the job no longer needs its engine
+    release: Callable | None = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "question": self.question,
+            "priority": self.priority,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "timings": self.timings,
+            "error": self.error,
+            "status_code": self.status_code,
+            "media_type": self.image.media_type if self.image else None,
+            "etag": self.image.etag if self.image else None,
+        }
+
+
+def _job_size(job):
+    return len(job.image.content) if job.image else 0
+
+
+class JobQueue:
+    """
+    Runs visualization requests in background workers, so clients submit a question,
+    poll its status and fetch the image instead of holding a connection open for the
+    whole pipeline. Jobs wait in a priority queue of bounded depth. Queued and running
+    jobs are held until they finished, then their state and images move to a local
+    store where they expire.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_depth=JOB_QUEUE_MAX_DEPTH, timeout=JOB_TIMEOUT):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.timeout = timeout
+        # Finished jobs only: queued and running ones must not expire or be evicted, they are
+        # bounded by the queue depth and the workers instead
+        self.jobs = TTLCache(max_entries=JOB_STORE_MAX_ENTRIES, ttl=JOB_TTL, max_bytes=JOB_STORE_MAX_BYTES, sizeof=_job_size)
+        self._active = {}
+        self._queue = None
+        self._workers = []
+        # Tie-breaker keeping jobs of the same priority in submission order
+        self._sequence = itertools.count()
+
+    def start(self):
+        """
+        Start the workers on the running event loop.
+        """
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_depth)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        JOB_QUEUE_DEPTH.set_function(self.depth)
+        logger.info(f"Job queue started with {self.workers} workers.")
+
+    async def stop(self):
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    def depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    def submit(
+        self, question, engine, use_templates=True, options=DEFAULT_IMAGE_OPTIONS, priority=JOB_DEFAULT_PRIORITY, release=None
+    ):
+        """
+        Queue a visualization job and return it. release is called when the job finished,
+        or at once when it is rejected.
+
+        Raises:
+            HTTPException: 503 when the queue is full or the workers are not running.
+        """
+        job = Job(uuid.uuid4().hex, question, engine, use_templates, options, priority, release=release)
+
+        if self._queue is None:
+            self._release(job)
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="The job queue is not running.")
+
+        try:
+            self._queue.put_nowait((priority, next(self._sequence), job))
+        except asyncio.QueueFull:
+            logger.warning("Job queue is full, rejecting the job.")
+            self._release(job)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many visualization jobs are waiting. Please try again shortly.",
+                headers={"Retry-After": str(QUEUE_FULL_RETRY_AFTER)},
+            )
+
+        self._active[job.id] = job
+        logger.info(f"Queued job {job.id} with priority {priority} ({self.depth()} waiting).")
+        return job
+
+    def get(self, job_id):
+        return self._active.get(job_id) or self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job. Returns the job, or None when it is unknown or expired.
+        """
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+
+        if job.task is not None:
+            job.task.cancel()
+        else:
+            # Still queued, the worker drops it when it comes up
+            self._finish(job, "cancelled")
+        return job
+
+    @staticmethod
+    def _release(job):
+        # The finished job no longer needs the connection's engine
+        job.engine = None
+        release, job.release = job.release, None
+        if release is not None:
+            release()
+
+    def _finish(self, job, job_status, error=None, status_code=None):
+        self._release(job)
+        job.status = job_status
+        job.error = error
+        job.status_code = status_code
+        job.finished_at = time.time()
+        # Moved to the store, where the job expires JOB_TTL after it finished and its image counts towards the store size
+        self._active.pop(job.id, None)
+        self.jobs.set(job.id, job)
+        record_job(job_status)
+
+    async def _work(self):
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                if job.status == "cancelled":
+                    continue
+
+                job.task = asyncio.create_task(self._run(job))
+                # Waiting without awaiting the task directly: cancelling the job must not stop the worker
+                await asyncio.wait([job.task])
+            except asyncio.CancelledError:
+                if job.task is not None:
+                    job.task.cancel()
+                raise
+            finally:
+                job.task = None
+                self._queue.task_done()
+
+    async def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+        job.timings["queue"] = round(job.started_at - job.submitted_at, 3)
+        logger.info(f"Running job {job.id}: {job.question}")
+
+        stage_started = time.monotonic()
+
+        async def on_event(event, data):
+            nonlocal stage_started
+            # Tokens stream while the plot code is generated, the "plot_code" event ends that stage
+            if event == "token":
+                return
+            now = time.monotonic()
+            job.timings[event] = round(job.timings.get(event, 0) + now - stage_started, 3)
+            stage_started = now
+
+        try:
+            with track_stage("job"):
+                job.image = await asyncio.wait_for(
+                    run_visualization_pipeline(job.question, job.engine, job.use_templates, on_event, job.options),
+                    timeout=self.timeout,
+                )
+            self._finish(job, "succeeded")
+
+        except asyncio.TimeoutError:
+            logger.error(f"Job {job.id} exceeded its time limit of {self.timeout}s.")
+            self._finish(job, "failed", "The visualization job exceeded its time limit.", status.HTTP_504_GATEWAY_TIMEOUT)
+
+        except asyncio.CancelledError:
+            logger.info(f"Job {job.id} was cancelled.")
+            self._finish(job, "cancelled")
+            raise
+
+        except HTTPException as e:
+            self._finish(job, "failed", e.detail, e.status_code)
+
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}")
+            self._finish(job, "failed", str(e), status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+job_queue = JobQueue()
@@ -0,0 +1,270 @@
+import ast
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from langchain_core.caches import BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# off: no caching, readwrite: answer from the cache and record new responses,
+# replay: answer only from the cache and fail on a miss, for offline load tests and CI
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "off").lower()
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite3")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+LLM_CACHE_MODES = ("off", "readwrite", "replay")
+
+# Invocation parameters that change how a response is delivered but not the response itself
+DELIVERY_PARAMS = ("stream",)
+
+# Reading the total size after every write would scan the table, check it every few writes instead
+EVICTION_CHECK_INTERVAL = 32
+
+
+class LLMCacheMiss(RuntimeError):
+    """
+    Raised in replay mode when a prompt has no recorded response.
+    """
+
+
+# Responses cached inside defer_cache_writes() are held back until the caller has validated them
+_pending_writes = contextvars.ContextVar("llm_cache_pending_writes", default=None)
+
+
+class PendingWrites:
+    """
+    Responses held back by defer_cache_writes(). commit() writes them to the cache,
+    responses that failed validation are dropped with this object.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def commit(self):
+        entries, self.entries = self.entries, []
+        for cache, prompt, llm_string, return_val in entries:
+            cache.write(prompt, llm_string, return_val)
+
+
+@contextmanager
+def defer_cache_writes():
+    """
+    Hold back the responses cached by the LLM calls made inside the block, so a malformed
+    response is never recorded and replayed. Yields the PendingWrites to commit once the
+    responses passed validation.
+    """
+    pending = PendingWrites()
+    token = _pending_writes.set(pending)
+    try:
+        yield pending
+    finally:
+        _pending_writes.reset(token)
+
+
+def _serialize(generation):
+    entry = {"text": generation.text, "generation_info": generation.generation_info}
+    if isinstance(generation, ChatGeneration):
+        entry["message"] = message_to_dict(generation.message)
+    return entry
+
+
+def _deserialize(entry):
+    if "message" in entry:
+        message = messages_from_dict([entry["message"]])[0]
+        return ChatGeneration(message=message, generation_info=entry["generation_info"])
+    return Generation(text=entry["text"], generation_info=entry["generation_info"])
+
+
+def without_delivery_params(llm_string):
+    """
+    Drop the DELIVERY_PARAMS from a LangChain llm string, which ends with the invocation
+    parameters as "[('stop', None), ('stream', True)]", after the serialized model and
+    "---" for serializable models. A streamed call and a plain call of the same prompt
+    then share one cache entry.
+    """
+    model, separator, params = llm_string.rpartition("---")
+
+    try:
+        items = ast.literal_eval(params)
+    except (ValueError, SyntaxError):
+        # Parameters that are not plain literals, such as tools, are kept as they are
+        return llm_string
+
+    if not isinstance(items, list) or not all(isinstance(item, tuple) and len(item) == 2 for item in items):
+        return llm_string
+    return f"{model}{separator}{[item for item in items if item[0] not in DELIVERY_PARAMS]}"
+
+
+def cache_key(prompt, llm_string):
+    """
+    Content address of an LLM call: the hash of the model configuration (model name,
+    temperature and the other invocation parameters) and the full prompt.
+    """
+    return hashlib.sha256(f"{without_delivery_params(llm_string)}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+class PersistentLLMCache(BaseCache):
+    """
+    LangChain LLM cache stored in a SQLite file, shared by every worker process on the host
+    and kept across restarts. Entries are evicted least recently used first once the
+    stored responses exceed `max_bytes`.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_bytes=LLM_CACHE_MAX_BYTES, replay=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at)")
+
+    def _connection(self):
+        # One connection per thread; WAL lets the worker processes read while one of them writes
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def lookup(self, prompt, llm_string):
+        key = cache_key(prompt, llm_string)
+        connection = self._connection()
+
+        row = connection.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            if self.replay:
+                raise LLMCacheMiss(f"No recorded LLM response for prompt {key[:12]} in replay mode.")
+            return None
+
+        connection.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+
+        try:
+            return [_deserialize(entry) for entry in json.loads(row[0])]
+        except Exception as e:
+            logger.warning(f"Dropping unreadable LLM cache entry {key[:12]}: {str(e)}")
+            connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            return None
+
+    def update(self, prompt, llm_string, return_val):
+        if self.replay:
+            return
+
+        pending = _pending_writes.get()
+        if pending is not None:
+            pending.entries.append((self, prompt, llm_string, return_val))
+            return
+
+        self.write(prompt, llm_string, return_val)
+
+    async def aupdate(self, prompt, llm_string, return_val):
+        # Checked in the caller's context, before the write is handed to a worker thread
+        pending = _pending_writes.get()
+        if pending is not None and not self.replay:
+            pending.entries.append((self, prompt, llm_string, return_val))
+            return
+
+        await super().aupdate(prompt, llm_string, return_val)
+
+    def write(self, prompt, llm_string, return_val):
+        response = json.dumps([_serialize(generation) for generation in return_val], default=str)
+        now = time.time()
+
+        self._connection().execute(
+            "INSERT OR REPLACE INTO llm_cache (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (cache_key(prompt, llm_string), response, len(response), now, now),
+        )
+
+        with self._writes_lock:
+            self._writes += 1
+            check = self._writes % EVICTION_CHECK_INTERVAL == 1
+        if check:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache fits its size cap.
+        """
+        connection = self._connection()
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Free a tenth of the budget at once so the next writes do not evict again right away
+        excess = total - self.max_bytes * 0.9
+        freed = evicted = 0
+        with connection:
+            rows = connection.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at").fetchall()
+            for key, size in rows:
+                if freed >= excess:
+                    break
+                connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                freed += size
+                evicted += 1
+
+        logger.info(f"Evicted {evicted} LLM cache entries ({freed} bytes).")
+
+    def clear(self, **kwargs):
+        self._connection().execute("DELETE FROM llm_cache")
+
+    def stats(self):
+        entries, size = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        return {
+            "mode": "replay" if self.replay else "readwrite",
+            "path": self.path,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def create_llm_cache(mode=LLM_CACHE_MODE):
+    """
+    Create the LLM cache for the configured mode, or return None when caching is off.
+    """
+    if mode not in LLM_CACHE_MODES:
+        raise ValueError(f"Unknown LLM_CACHE_MODE '{mode}', expected one of {', '.join(LLM_CACHE_MODES)}.")
+
+    if mode == "off":
+        return None
+
+    logger.info(f"LLM response cache in {mode} mode at {LLM_CACHE_PATH}.")
+    return PersistentLLMCache(replay=mode == "replay")
+
+
+llm_cache = create_llm_cache()
@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_groq import ChatGroq
+
+from app.services.llm_cache import LLM_CACHE_MODE, llm_cache
+from app.utils.metrics import record_retry
+from app.utils.prompt_encoding import estimate_tokens
+from app.utils.shared_slots import SharedSlots
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Provider limits shared by every LLM call of this process, 0 disables a limit
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "30"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "30000"))
+
+# LLM calls in flight at the same time
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# Retries of rate limited, overloaded or failed requests, with jittered exponential backoff
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+
+# Completion tokens reserved for a call whose answer length is not known in advance
+COMPLETION_TOKEN_ESTIMATE = 512
+
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_minute`. Reservations are taken
+    immediately and may push the bucket into debt; each caller then waits until its
+    share has been refilled, so a burst is spread out instead of rejected.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, amount):
+        """
+        Take `amount` tokens and return the seconds to wait before they are available.
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, seconds):
+        """
+        Make the next reservations wait at least `seconds`, e.g. after the provider answered 429.
+        """
+        if self.rate <= 0:
+            return
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+def _status_code(error):
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code
+
+
+def is_retryable(error):
+    """
+    Whether a failed LLM request may succeed when sent again: rate limits,
+    provider overload and server errors, timeouts and connection errors.
+    """
+    if isinstance(error, (httpx.TimeoutException, httpx.NetworkError)):
+        return True
+    if type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return True
+    return _status_code(error) in RETRYABLE_STATUS_CODES
+
+
+def retry_after(error):
+    """
+    Seconds the provider asked us to wait in its Retry-After headers, or None.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # An HTTP date instead of seconds
+        pass
+    return None
+
+
+def backoff_delay(attempt, error=None):
+    """
+    Full-jitter exponential backoff, never shorter than the provider's Retry-After.
+    """
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2**attempt))
+    requested = retry_after(error) if error is not None else None
+    if requested is not None:
+        delay = max(delay, min(requested, LLM_BACKOFF_MAX))
+    return delay
+
+
+def llm_error(error):
+    """
+    HTTP error for an LLM call that failed for good, after the gateway's own retries.
+    Callers raise it instead of retrying again, which would multiply the calls sent to a struggling provider.
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE if is_retryable(error) else status.HTTP_502_BAD_GATEWAY
+    return HTTPException(status_code=status_code, detail=f"The language model request failed: {type(error).__name__}: {error}")
+
+
+class LLMGateway:
+    """
+    Single entry point for LLM calls: shares the provider's request and token rate limits,
+    caps the calls in flight, and retries transient failures with jittered backoff.
+
+    Clients created with get_llm() do not retry on their own, so retries are never stacked.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+        max_concurrency=LLM_MAX_CONCURRENCY,
+        max_retries=LLM_MAX_RETRIES,
+    ):
+        self.max_retries = max_retries
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        # One budget for the asyncio calls and the legacy synchronous calls together
+        self._slots = SharedSlots(max_concurrency)
+
+    def _reserve(self, input):
+        # Replayed responses never reach the provider
+        if LLM_CACHE_MODE == "replay":
+            return 0.0
+
+        tokens = estimate_tokens(str(input)) + COMPLETION_TOKEN_ESTIMATE
+        return max(self.request_bucket.reserve(1), self.token_bucket.reserve(tokens))
+
+    def _on_failure(self, error, attempt):
+        """
+        Return the seconds to wait before the next attempt, or re-raise when the error is final.
+        """
+        if attempt >= self.max_retries or not is_retryable(error):
+            raise error
+
+        delay = backoff_delay(attempt, error)
+        if _status_code(error) == 429:
+            # Hold back every caller, not just this one, until the provider's window has passed
+            self.request_bucket.pause(delay)
+
+        record_retry("llm")
+        logger.warning(
+            f"LLM request failed ({type(error).__name__}: {error}), "
+            f"retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})."
+        )
+        return delay
+
+    async def ainvoke(self, runnable, input, config=None, **kwargs):
+        """
+        Invoke a chat model or a chain containing one, under the gateway's limits.
+        Extra keyword arguments are passed to the model, e.g. `stream=True`.
+        """
+        attempt = 0
+        while True:
+            # Wait for the rate limit before taking a slot, so waiting calls do not hold slots that others could use
+            await asyncio.sleep(self._reserve(input))
+            async with self._slots:
+                try:
+                    return await runnable.ainvoke(input, config=config, **kwargs)
+                except Exception as e:
+                    delay = self._on_failure(e, attempt)
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def invoke(self, runnable, input, config=None, **kwargs):
+        """
+        Synchronous variant of ainvoke, for code running outside the event loop.
+        """
+        attempt = 0
+        while True:
+            time.sleep(self._reserve(input))
+            with self._slots:
+                try:
+                    return runnable.invoke(input, config=config, **kwargs)
+                except Exception as e:
+                    delay = self._on_failure(e, attempt)
+
+            attempt += 1
+            time.sleep(delay)
+
+
+class TokenStreamCallback(AsyncCallbackHandler):
+    """
+    LangChain callback passing each token of a streamed completion to `on_token`, a coroutine function.
+    The model only streams when invoked with `stream=True`; responses answered
+    from the cache arrive whole and produce no tokens.
+    """
+
+    def __init__(self, on_token):
+        self.on_token = on_token
+
+    async def on_llm_new_token(self, token, **kwargs):
+        if token:
+            await self.on_token(token)
+
+
+# One connection pool for every Groq client, instead of one per client
+limits = httpx.Limits(max_connections=LLM_HTTP_MAX_CONNECTIONS, max_keepalive_connections=LLM_HTTP_MAX_CONNECTIONS)
+http_client = httpx.Client(limits=limits, timeout=LLM_REQUEST_TIMEOUT)
+http_async_client = httpx.AsyncClient(limits=limits, timeout=LLM_REQUEST_TIMEOUT)
+
+llm_gateway = LLMGateway()
+
+_llms = {}
+_llms_lock = threading.Lock()
+
+
+def get_llm(model="llama3-8b-8192", temperature=0, cache=True):
+    """
+    Return the shared Groq chat model for a model name and temperature, using the shared
+    HTTP connection pool and, unless `cache` is False, the persistent response cache.
+    In replay mode the cache is always used, so a miss raises LLMCacheMiss instead of calling Groq.
+    Calls must go through llm_gateway, the client itself never retries.
+    """
+    cache = cache or LLM_CACHE_MODE == "replay"
+    with _llms_lock:
+        key = (model, temperature, cache)
+        if key not in _llms:
+            _llms[key] = ChatGroq(
+                model=model,
+                temperature=temperature,
+                max_tokens=None,
+                timeout=LLM_REQUEST_TIMEOUT,
+                max_retries=0,
+                http_client=http_client,
+                http_async_client=http_async_client,
+                cache=llm_cache if cache else False,
+            )
+        return _llms[key]
+
+
+async def close_http_clients():
+    http_client.close()
+    await http_async_client.aclose()
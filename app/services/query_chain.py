@@ -1,17 +1,27 @@
 from fastapi import HTTPException, status, responses
+from fastapi.concurrency import run_in_threadpool
+import asyncio
 import re
-import time
+from contextlib import nullcontext
+from dataclasses import dataclass
 from langchain.chains.sql_database.query import create_sql_query_chain
-from langchain.sql_database import SQLDatabase
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
 import os
+from app.services.llm_cache import PendingWrites, defer_cache_writes
+from app.services.llm_gateway import TokenStreamCallback, get_llm, llm_error, llm_gateway
 from app.services.query_service import execute_sql
 from app.utils.clean_ai_plot_code import clean_ai_plot_code
 import ast
 import logging
-from app.utils.sql_utils import get_database_schema
-from app.utils.visualization_utils import detect_chart_type_with_llm
+from app.db.schema_cache import get_schema_entry
+from app.utils.sql_utils import column_signature, format_schema_description
+from app.utils.cache import TTLCache
+from app.utils.metrics import llm_config, record_retry, register_cache, timed, track_stage
+from app.utils.question_utils import normalize_question
+from app.utils.prompt_encoding import encode_result_for_prompt
+from app.utils.schema_index import SCHEMA_PRUNE_MIN_TABLES
+from app.utils.sql_validation import find_disallowed_statement, parse_sql, validate_references
+from app.utils.visualization_utils import detect_chart_type
 
 
 logger = logging.getLogger(__name__)
@@ -30,13 +40,26 @@ api_key = os.getenv("GROQ_API_KEY")
 
 # llm = Ollama(model="llama3.2")
 
-groq_llm = ChatGroq(
-    model="llama3-8b-8192",
-    temperature=0.7,
-    max_tokens=None,
-    timeout=None,
-    max_retries=10,
+groq_llm = get_llm("llama3-8b-8192", temperature=0.7)
+
+# Used for retries and for new plot code when the cached code failed, so a recorded response is not replayed.
+# In replay mode this is the cached client too, replay never calls Groq.
+uncached_groq_llm = get_llm("llama3-8b-8192", temperature=0.7, cache=False)
+
+# Validated SQL that ran successfully, keyed by (normalized question, schema fingerprint)
+sql_cache = TTLCache(
+    max_entries=int(os.getenv("SQL_CACHE_MAX_ENTRIES", "512")),
+    ttl=float(os.getenv("SQL_CACHE_TTL", "86400")),
 )
+register_cache("sql", sql_cache)
+
+# Cleaned and validated plot code, keyed by (normalized question, chart type, column signature).
+# The code reads its data from `result`, so it can be re-run on fresh rows with the same columns.
+plot_code_cache = TTLCache(
+    max_entries=int(os.getenv("PLOT_CODE_CACHE_MAX_ENTRIES", "256")),
+    ttl=float(os.getenv("PLOT_CODE_CACHE_TTL", "86400")),
+)
+register_cache("plot_code", plot_code_cache)
 
 
 def validate_python_code(python_code):
@@ -88,11 +111,36 @@ def extract_sql_from_response(response_text):
         return None
 
 
-def generate_sql_and_execute(question, engine, max_retries=5):
+def close_result(result):
+    # Streamed results hold a database connection until they are closed
+    close = getattr(result, "close", None)
+    if close is not None:
+        close()
+
+
+@timed("generate_sql_and_execute")
+async def generate_sql_and_execute(
+    question,
+    engine,
+    max_retries=5,
+    execute=execute_sql,
+    schema_entry=None,
+    llm_semaphore=None,
+    db_semaphore=None,
+):
     """
     A function that will generate SQL from Text and execute them to get results.
     The result will then be responded back to the user in plain human language.
+
+    `execute` runs the generated query and returns its rows; pass `open_sql_stream` to only
+    fetch the first chunk when the caller streams the rest of the result from the same cursor.
+
+    Batch callers pass the `schema_entry` they looked up once for all questions, and
+    asyncio semaphores limiting the concurrent LLM calls and query executions.
     """
+    llm_slot = llm_semaphore or nullcontext()
+    db_slot = db_semaphore or nullcontext()
+
     try:
         if not engine:
             raise HTTPException(
@@ -100,16 +148,43 @@ def generate_sql_and_execute(question, engine, max_retries=5):
                 detail="Database connection is not established. Please connect to a database first.",
             )
 
-        # Create Langchain SQLDatabase object using the engine
-        db = SQLDatabase(engine)
-
-        # Get the schema of the connected database
-        schema = get_database_schema(engine)
+        # Get the cached schema and Langchain SQLDatabase object of the connected database
+        if schema_entry is None:
+            with track_stage("schema"):
+                schema_entry = await run_in_threadpool(get_schema_entry, engine)
+        db = schema_entry.db
+        schema = schema_entry.schema
+
+        # A cached query for the same question and schema skips the LLM entirely
+        cache_key = (normalize_question(question), schema_entry.fingerprint)
+        cached_sql = sql_cache.get(cache_key)
+
+        if cached_sql:
+            logger.info(f"Using cached SQL query for question: {question}")
+            async with db_slot:
+                result = await run_in_threadpool(execute, engine, cached_sql)
+
+            if result:
+                return {"response": cached_sql, "result": result}
+            close_result(result)
+
+            # The cached query no longer returns data, generate a new one
+            logger.warning("Cached SQL query returned no data, regenerating it.")
+            sql_cache.pop(cache_key)
+
+        # On wide schemas only the tables relevant to the question (and the tables they reference)
+        # go into the prompt; generated queries are still validated against the full schema
+        table_names = []
+        if len(schema) > SCHEMA_PRUNE_MIN_TABLES:
+            usable_tables = set(db.get_usable_table_names())
+            table_names = [name for name in schema_entry.schema_index.relevant_tables(question) if name in usable_tables]
+            logger.info(f"Selected {len(table_names)} of {len(schema)} tables for the prompt: {table_names}")
 
         # Build a dynamic schema description for the LLM
-        schema_description = "\n".join(
-            [f"{table}: {', '.join(columns)}" for table, columns in schema.items()]
-        )
+        if table_names:
+            schema_description = format_schema_description({name: schema[name] for name in table_names})
+        else:
+            schema_description = format_schema_description(schema)
 
         # Initialize retry mechanism variables
         attempt = 0
@@ -146,8 +221,19 @@ def generate_sql_and_execute(question, engine, max_retries=5):
 
             try:
                 # Generate the SQL query using the LLM
-                sql_chain = create_sql_query_chain(groq_llm, db)
-                response = sql_chain.invoke({"question": prompt}).strip()
+                sql_chain = create_sql_query_chain(groq_llm if attempt == 1 else uncached_groq_llm, db)
+                chain_input = {"question": prompt}
+                if table_names:
+                    chain_input["table_names_to_use"] = table_names
+                async with llm_slot:
+                    with track_stage("llm_sql_generation"), defer_cache_writes() as cache_writes:
+                        try:
+                            response = (
+                                await llm_gateway.ainvoke(sql_chain, chain_input, config=llm_config("sql_generation"))
+                            ).strip()
+                        except Exception as e:
+                            # The gateway already retried transient failures, this loop only retries invalid queries
+                            raise llm_error(e)
 
                 # Validate the SQL query to check for INSERT, UPDATE, DELETE
                 def validate_sql_query(query: str):
@@ -168,10 +254,27 @@ def generate_sql_and_execute(question, engine, max_retries=5):
                         detail=f"We only allow SELECT records from the database, not {invalid_keyword.lower()} them.",
                     )
 
+                # Parse and check the query locally, so invalid queries never reach the database
+                parsed_query = parse_sql(response, engine.dialect.name)
+
+                disallowed_statement = find_disallowed_statement(parsed_query)
+                if disallowed_statement:
+                    logger.error(f"Unsafe query detected: {disallowed_statement} statement.")
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"We only allow SELECT records from the database, not {disallowed_statement} statements.",
+                    )
+
+                reference_error = validate_references(parsed_query, schema_entry.column_index)
+                if reference_error:
+                    raise ValueError(f"Invalid SQL query: {reference_error}")
+
                 # If the query is valid, execute it
-                result = execute_sql(engine, response)
+                async with db_slot:
+                    result = await run_in_threadpool(execute, engine, response)
 
                 if not result or len(result) == 0:
+                    close_result(result)
                     logger.warning(
                         "No data found for the query. There might be no matching records."
                     )
@@ -183,6 +286,11 @@ def generate_sql_and_execute(question, engine, max_retries=5):
                 # Log the SQL execution result
                 logger.info(f"SQL execution result: {result}")
 
+                # Remember the query that worked for this question, and the LLM response only now it is known to work
+                sql_cache.set(cache_key, response)
+                if cache_writes:
+                    await run_in_threadpool(cache_writes.commit)
+
                 # Return the successful result
                 return {"response": response, "result": result}
 
@@ -205,6 +313,7 @@ def generate_sql_and_execute(question, engine, max_retries=5):
                     )
 
                 # Retry with modified prompt based on error message
+                record_retry("sql_generation")
                 logger.info(f"Retrying... (Attempt {attempt + 1}/{max_retries})")
     except HTTPException as e:
         # Raise HTTP Exception for general errors
@@ -215,22 +324,72 @@ def generate_sql_and_execute(question, engine, max_retries=5):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
-def generate_plot_code_from_ai(result, question, max_retries=5, sleep_interval=1):
+@dataclass
+class GeneratedPlotCode:
+    code: str
+    cache_key: tuple
+    # True when the code came from plot_code_cache rather than from the LLM
+    cached: bool
+    # The LLM response, recorded by remember_plot_code() once the code rendered
+    cache_writes: PendingWrites | None = None
+
+
+async def remember_plot_code(plot_code):
+    """
+    Cache newly generated plot code after it rendered successfully, together with its LLM response.
+    """
+    if plot_code.cached:
+        return
+
+    plot_code_cache.set(plot_code.cache_key, plot_code.code)
+    if plot_code.cache_writes:
+        await run_in_threadpool(plot_code.cache_writes.commit)
+
+
+def invalidate_plot_code(plot_code):
+    """
+    Evict cached plot code, e.g. after it failed to render.
+    """
+    plot_code_cache.pop(plot_code.cache_key)
+
+
+@timed("generate_plot_code_from_ai")
+async def generate_plot_code_from_ai(result, question, max_retries=5, sleep_interval=1, use_cache=True, on_event=None):
+    """
+    Generate Python code drawing the SQL result as a chart, retrying until the code is valid.
+    New code is only cached by remember_plot_code(), once it has rendered.
+
+    `on_event`, an optional coroutine function taking an event name and its data, is told
+    the detected chart type and receives the tokens of the code as the LLM writes them.
+    """
     retry_count = 0
     error_message = ""
     incomplete_code = False
 
-    # Detect the chart type using the new LLM-based function
-    chart_type = detect_chart_type_with_llm(result, question)
+    # Detect the chart type locally, falling back to the LLM when the heuristics are unsure
+    chart_type = await detect_chart_type(result, question)
 
     if not chart_type:
-        logger.error(f"Failed to detect chart type using LLM.")
+        logger.error(f"Failed to detect chart type.")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Failed to detect chart type for the given result.",
         )
 
-    formatted_sql_result = str(result)
+    if on_event:
+        await on_event("chart_type", {"chart_type": chart_type, "renderer": "generated_code"})
+
+    # Plot code generated earlier for the same question, chart type and columns skips the LLM
+    cache_key = (normalize_question(question), chart_type.strip().lower(), column_signature(result))
+
+    if use_cache:
+        cached_plot_code = plot_code_cache.get(cache_key)
+        if cached_plot_code:
+            logger.info("Using cached plot code.")
+            return GeneratedPlotCode(cached_plot_code, cache_key, cached=True)
+
+    # Compact encoding for the prompt, the plot code itself reads the full data from `result`
+    formatted_sql_result = encode_result_for_prompt(result)
 
     while retry_count < max_retries:
         # Prepare the prompt for generating Python code
@@ -241,7 +400,7 @@ def generate_plot_code_from_ai(result, question, max_retries=5, sleep_interval=1
 
         Based on this query result, generate Python code to create a professional and error-free {chart_type} visualization using Seaborn or Matplotlib. Ensure that the Python code:
 
-        1. Converts any list or dictionary data into a Pandas DataFrame before plotting.
+        1. Reads the data from the existing variable `result` (a list of dictionaries, one per row, holding the complete query result) and converts it into a Pandas DataFrame before plotting. Never hardcode data values in the code.
         2. Only converts numeric values (e.g., Decimal types) to floats, but **avoids converting string columns** (like 'customer_name') into numeric values.
         3. Follows correct Python syntax and ensures the code is complete, avoiding errors such as unterminated strings, unmatched parentheses, and incomplete code.
         4. Uses Seaborn for plotting, with a modern style like 'darkgrid'. Ensure to apply styles using `sns.set_style("darkgrid")` and not as plot parameters.
@@ -263,7 +422,7 @@ def generate_plot_code_from_ai(result, question, max_retries=5, sleep_interval=1
         - If the user asked to exclude or include certain data points, ensure that the generated code handles these cases properly by filtering the dataset.
         - If the generated code is too large to fit in one response, generate it in parts. Return only the Python code. Do not include any extra text, language identifiers (like 'Python:'), or comments.
         - Do not include any language identifiers (like 'Python' or 'Python:')
-        - Ensure the generated data is complete. If ellipsis (...) appears in the data, return the full data instead.
+        - The query result shown above may be a sample or summary. Do not copy it into the code; always build the DataFrame from the `result` variable.
 
         The user's question was: {question}
         """
@@ -272,7 +431,26 @@ def generate_plot_code_from_ai(result, question, max_retries=5, sleep_interval=1
             logger.info(
                 f"Attempt {retry_count + 1}: Invoking AI to generate Python code for visualization."
             )
-            ai_response = groq_llm.invoke(prompt)
+            config = llm_config("plot_code")
+            stream_options = {}
+            if on_event:
+                attempt = retry_count + 1
+
+                async def on_token(token):
+                    await on_event("token", {"text": token, "attempt": attempt})
+
+                config["callbacks"].append(TokenStreamCallback(on_token))
+                # The LLM cache ignores the flag, streamed and plain calls share their entries
+                stream_options["stream"] = True
+
+            # Retries send the same prompt, they must not be answered with the rejected response again
+            with track_stage("llm_plot_code"), defer_cache_writes() as cache_writes:
+                llm = groq_llm if use_cache and retry_count == 0 else uncached_groq_llm
+                try:
+                    ai_response = await llm_gateway.ainvoke(llm, prompt, config=config, **stream_options)
+                except Exception as e:
+                    # The gateway already retried transient failures, this loop only retries invalid code
+                    raise llm_error(e)
 
             if not ai_response or not ai_response.content:
                 raise ValueError("No valid plot code was generated by the AI.")
@@ -300,7 +478,10 @@ def generate_plot_code_from_ai(result, question, max_retries=5, sleep_interval=1
                 raise ValueError(f"Plot execution failed: {validation_result}")
 
             logger.info("Python code generation and execution successful.")
-            return cleaned_plot_code
+            return GeneratedPlotCode(cleaned_plot_code, cache_key, cached=False, cache_writes=cache_writes)
+
+        except HTTPException:
+            raise
 
         except Exception as e:
             retry_count += 1
@@ -317,7 +498,8 @@ def generate_plot_code_from_ai(result, question, max_retries=5, sleep_interval=1
                 )
 
             logger.info(f"Retrying in {sleep_interval} seconds...")
-            time.sleep(sleep_interval)
+            record_retry("plot_code")
+            await asyncio.sleep(sleep_interval)
 
     raise HTTPException(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from sqlalchemy import text
+from sqlglot import exp
+
+from app.utils.sql_validation import SQLGLOT_DIALECTS, parse_sql
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Rows returned by a generated query when it has no LIMIT of its own, 0 disables the limit
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "10000"))
+
+# Row limit for streamed results, which are meant for large exports, 0 disables it
+STREAM_MAX_ROWS = int(os.getenv("STREAM_MAX_ROWS", "0"))
+
+# Per-query execution time limit in milliseconds, 0 disables it
+QUERY_TIMEOUT_MS = int(os.getenv("QUERY_TIMEOUT_MS", "30000"))
+
+# EXPLAIN the query first and reject plans above these estimates
+QUERY_EXPLAIN_GUARD = os.getenv("QUERY_EXPLAIN_GUARD", "false").lower() in ("1", "true", "yes")
+QUERY_MAX_PLAN_COST = float(os.getenv("QUERY_MAX_PLAN_COST", "10000000"))
+QUERY_MAX_PLAN_ROWS = float(os.getenv("QUERY_MAX_PLAN_ROWS", "10000000"))
+
+# Driver error codes for a query cancelled by its time limit
+POSTGRES_QUERY_CANCELED = "57014"
+MYSQL_QUERY_TIMEOUT = 3024
+
+
+def apply_row_limit(query, dialect_name, max_rows=QUERY_MAX_ROWS):
+    """
+    Add a LIMIT to a query that has none, or lower a literal LIMIT above `max_rows`.
+    Queries that already fit are returned unchanged.
+
+    Raises:
+        HTTPException: 400 when the query does not parse, so it never runs without its limit.
+    """
+    if not max_rows:
+        return query
+
+    try:
+        tree = parse_sql(query, dialect_name)
+    except ValueError as e:
+        logger.error(f"Cannot apply the row limit, the query does not parse: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid SQL query: {str(e)}")
+    limit = tree.args.get("limit")
+
+    if limit is None and tree.args.get("offset") is None and not tree.args.get("fetch") and "--" not in query:
+        # Appending keeps the query text exactly as generated and validated, a trailing
+        # line comment would swallow the LIMIT so those queries are rewritten instead
+        return f"{query.strip().rstrip(';').rstrip()} LIMIT {int(max_rows)}"
+
+    if limit is not None:
+        value = limit.expression
+        if not (isinstance(value, exp.Literal) and value.is_int and int(value.name) > max_rows):
+            return query
+
+    return tree.limit(max_rows).sql(dialect=SQLGLOT_DIALECTS.get(dialect_name))
+
+
+@contextmanager
+def statement_timeout(connection, timeout_ms=QUERY_TIMEOUT_MS):
+    """
+    Limit the execution time of the statements run on the connection inside the block.
+    """
+    dialect_name = connection.dialect.name
+
+    if not timeout_ms or dialect_name not in ("postgresql", "mysql"):
+        yield
+        return
+
+    if dialect_name == "postgresql":
+        # SET LOCAL ends with the transaction, so the pooled connection is left as it was
+        connection.execute(text(f"SET LOCAL statement_timeout = {int(timeout_ms)}"))
+        yield
+        return
+
+    connection.execute(text(f"SET SESSION max_execution_time = {int(timeout_ms)}"))
+    try:
+        yield
+    finally:
+        connection.execute(text("SET SESSION max_execution_time = DEFAULT"))
+
+
+def _max_rows_produced(node):
+    """
+    Largest rows_produced_per_join anywhere in a MySQL JSON plan. Joins, sorts and groupings nest
+    their tables under nested_loop, ordering_operation or grouping_operation rather than query_block.table.
+    """
+    if isinstance(node, list):
+        return max((_max_rows_produced(item) for item in node), default=0.0)
+    if not isinstance(node, dict):
+        return 0.0
+
+    rows = float(node.get("rows_produced_per_join", 0))
+    return max([rows] + [_max_rows_produced(value) for value in node.values() if isinstance(value, (dict, list))])
+
+
+def _plan_estimates(connection, query):
+    """
+    Return the planner's estimated (cost, rows) for a query, or None when the dialect has no JSON EXPLAIN.
+    """
+    dialect_name = connection.dialect.name
+
+    if dialect_name == "postgresql":
+        plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {query}")).scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        root = plan[0]["Plan"]
+        return float(root["Total Cost"]), float(root["Plan Rows"])
+
+    if dialect_name == "mysql":
+        plan = json.loads(connection.execute(text(f"EXPLAIN FORMAT=JSON {query}")).scalar())
+        query_block = plan.get("query_block", {})
+        cost = float(query_block.get("cost_info", {}).get("query_cost", 0))
+        rows = _max_rows_produced(query_block)
+        return cost, rows
+
+    return None
+
+
+def check_query_cost(connection, query):
+    """
+    Run EXPLAIN and reject queries whose estimated cost or row count is above the configured thresholds.
+
+    Raises:
+        HTTPException: 400 when the plan is too expensive.
+    """
+    if not QUERY_EXPLAIN_GUARD:
+        return
+
+    estimates = _plan_estimates(connection, query)
+    if estimates is None:
+        return
+
+    cost, rows = estimates
+    logger.info(f"Query plan estimate: cost {cost:.0f}, rows {rows:.0f}")
+
+    if cost > QUERY_MAX_PLAN_COST or rows > QUERY_MAX_PLAN_ROWS:
+        logger.warning(f"Rejected expensive query (cost {cost:.0f}, rows {rows:.0f}): {query}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The query is too expensive to run (estimated cost {cost:.0f}, {rows:.0f} rows). "
+            f"Please narrow down your question.",
+        )
+
+
+def is_timeout_error(error):
+    """
+    Whether a database error means the query was cancelled by its time limit.
+    """
+    original = getattr(error, "orig", error)
+    return getattr(original, "pgcode", None) == POSTGRES_QUERY_CANCELED or getattr(original, "errno", None) == MYSQL_QUERY_TIMEOUT
+
+
+def timeout_exception():
+    return HTTPException(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        detail=f"The query took longer than the {QUERY_TIMEOUT_MS} ms limit. Please narrow down your question.",
+    )
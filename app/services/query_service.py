@@ -1,23 +1,34 @@
 from sqlalchemy import text
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
+from datetime import date, datetime, time
+from decimal import Decimal
+import json
 import os
+from contextlib import ExitStack
 from langchain_core.prompts import PromptTemplate
 from langchain.chains.sql_database.query import create_sql_query_chain
+from fastapi import HTTPException
+from app.services.llm_gateway import get_llm, llm_gateway
+from app.services.query_governor import (
+    STREAM_MAX_ROWS,
+    apply_row_limit,
+    check_query_cost,
+    is_timeout_error,
+    statement_timeout,
+    timeout_exception,
+)
+from app.utils.cache import TTLCache
+from app.utils.columnar import ColumnarResult
+from app.utils.metrics import record_result_size, register_cache, timed
 from app.utils.sql_extraction import extract_sql_query
+from app.utils.sql_utils import canonicalize_sql
 
 load_dotenv()
 
 # Get the api key from the environment
 api_key = os.getenv("GROQ_API_KEY")
 
-groq_llm = ChatGroq(
-    model="llama3-groq-8b-8192-tool-use-preview",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-)
+groq_llm = get_llm("llama3-groq-8b-8192-tool-use-preview", temperature=0)
 
 # Defining prompt template: For connecting to database and generate SQL Queries
 prompt_template = """
@@ -28,13 +39,43 @@ Question: {question}
 
 prompt = PromptTemplate.from_template(prompt_template)
 
+# Optional cache of query results, keyed by connection and canonical SQL text
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+
+result_cache = TTLCache(
+    max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000")),
+    ttl=float(os.getenv("RESULT_CACHE_TTL", "60")),
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+)
+register_cache("result", result_cache)
+
+# Rows fetched per round trip when streaming results from a server-side cursor
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "1000"))
+
+# One-row queries whose value changes whenever rows are written to any table.
+# MySQL: information_schema.TABLES is cached for information_schema_stats_expiry and its UPDATE_TIME
+# is often NULL, so the row write counters of performance_schema are read instead. Without
+# performance_schema (disabled, or no SELECT privilege on it) the query returns NULL or fails,
+# and cached results only expire through RESULT_CACHE_TTL.
+DATA_VERSION_QUERIES = {
+    "postgresql": """
+        SELECT count(*) || ':' || coalesce(sum(n_tup_ins + n_tup_upd + n_tup_del), 0)
+        FROM pg_stat_user_tables
+    """,
+    "mysql": """
+        SELECT CONCAT(COUNT(*), ':', SUM(COUNT_INSERT + COUNT_UPDATE + COUNT_DELETE))
+        FROM performance_schema.table_io_waits_summary_by_table
+        WHERE OBJECT_SCHEMA = DATABASE()
+    """,
+}
+
 
 def get_ai_response(db_type, question):
     # Format the prompt with the context
     prompt_with_context = prompt.format(db_type=db_type, question=question)
     try:
         # Invoke the Groq LLM by passing the prompt as a string, not a dictionary
-        ai_response = groq_llm.invoke(prompt_with_context)  # Pass prompt_with_context as a string
+        ai_response = llm_gateway.invoke(groq_llm, prompt_with_context)  # Pass prompt_with_context as a string
 
         return ai_response
 
@@ -50,7 +91,7 @@ def generate_sql_from_question(db_type, question):
 
     try:
         # Invoke the Groq LLM by passing the prompt as a string, not a dictionary
-        ai_response = groq_llm.invoke(prompt_with_context)  # Pass prompt_with_context as a string
+        ai_response = llm_gateway.invoke(groq_llm, prompt_with_context)  # Pass prompt_with_context as a string
 
         # Extract the SQL query from the response content
         sql_response = extract_sql_query(ai_response.content)
@@ -63,22 +104,163 @@ def generate_sql_from_question(db_type, question):
         return None  # Return None in case of an error, so it's not passed to SQL execution
 
 
+def get_data_version(connection):
+    """
+    Read the data version signal of the connected database, or None when the
+    dialect has none and cached results only expire through the TTL.
+    """
+    query = DATA_VERSION_QUERIES.get(connection.dialect.name)
+    if query is None:
+        return None
+
+    try:
+        version = connection.execute(text(query)).scalar()
+        return None if version is None else str(version)
+    except Exception as e:
+        print(f"Error reading data version: {str(e)}")
+        return None
+
+
 # function that will execute the generated SQL query from the AI
+@timed("execute_sql")
 def execute_sql(engine, query):
     if query is None:
         print("No valid SQL query to execute.")
         return None
     try:
+        # Bound the rows the query can return before it reaches the database
+        query = apply_row_limit(query, engine.dialect.name)
+
         with engine.connect() as connection:
-            result = connection.execute(text(query))
-            rows = result.fetchall()
+            if RESULT_CACHE_ENABLED:
+                cache_key = (str(engine.url), canonicalize_sql(query))
+                data_version = get_data_version(connection)
+
+                cached = result_cache.get(cache_key)
+                if cached is not None:
+                    cached_version, cached_rows = cached
+                    if cached_version == data_version:
+                        # Shallow copy, callers convert columns in place
+                        record_result_size(cached_rows)
+                        return cached_rows.copy()
+
+                    # Rows were written since the result was cached
+                    result_cache.pop(cache_key)
+
+            with statement_timeout(connection):
+                check_query_cost(connection, query)
+
+                result = connection.execute(text(query))
+
+                # Store the rows column by column, straight from the cursor
+                rows = ColumnarResult.from_cursor(result)
+
+            record_result_size(rows)
+
+            if RESULT_CACHE_ENABLED:
+                result_cache.set(cache_key, (data_version, rows.copy()))
+
+            return rows
+    except HTTPException:
+        raise
+    except Exception as e:
+        if is_timeout_error(e):
+            raise timeout_exception()
+        print(f"Error executing SQL: {str(e)}")
+        return None
+
+
+class SQLStream:
+    """
+    A query running on a server-side cursor. The first chunk of rows is fetched when the
+    stream is opened, so the caller can check that the query returns data; the remaining
+    chunks are read from the same cursor when the stream is iterated.
+
+    len() and truthiness describe the first chunk. The connection stays checked out until
+    the stream was iterated to the end or closed.
+    """
+
+    def __init__(self, stack, result, chunk_size):
+        self._stack = stack
+        self._result = result
+        self.columns = list(result.keys())
+        self._partitions = result.partitions(chunk_size)
+        self.first_rows = self._rows(next(self._partitions, []))
+
+    def _rows(self, partition):
+        return [dict(zip(self.columns, row)) for row in partition]
+
+    def __len__(self):
+        return len(self.first_rows)
+
+    def __bool__(self):
+        return bool(self.first_rows)
+
+    def __repr__(self):
+        return f"SQLStream(first {len(self.first_rows)} rows, columns={self.columns})"
+
+    def chunks(self):
+        """
+        Yield the rows in chunks of dictionaries, starting with the first chunk, and close the stream at the end.
+        """
+        try:
+            if self.first_rows:
+                yield self.first_rows
+            for partition in self._partitions:
+                yield self._rows(partition)
+        finally:
+            self.close()
+
+    def close(self):
+        self._stack.close()
+
 
-            # Fetch the column names
-            columns = result.keys()
+def open_sql_stream(engine, query, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Execute a query on a server-side cursor and fetch its first chunk of rows.
+    The query runs once; its remaining rows are streamed from the same cursor by SQLStream.chunks().
 
-            # Convert the result rows into a list of dictionaries
-            row_dicts = [dict(zip(columns, row)) for row in rows]
-            return row_dicts
+    Returns:
+        SQLStream: The open stream, or None on error.
+    """
+    if query is None:
+        print("No valid SQL query to execute.")
+        return None
+
+    query = apply_row_limit(query, engine.dialect.name, STREAM_MAX_ROWS)
+
+    stack = ExitStack()
+    try:
+        connection = stack.enter_context(engine.connect())
+        stack.enter_context(statement_timeout(connection))
+        check_query_cost(connection, query)
+
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(text(query))
+        stack.callback(result.close)
+
+        return SQLStream(stack, result, chunk_size)
+    except HTTPException:
+        stack.close()
+        raise
     except Exception as e:
+        stack.close()
+        if is_timeout_error(e):
+            raise timeout_exception()
         print(f"Error executing SQL: {str(e)}")
         return None
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    return str(value)
+
+
+def stream_sql_as_ndjson(stream):
+    """
+    Stream the rows of an open SQLStream as newline-delimited JSON, one encoded chunk at a time.
+    """
+    for rows in stream.chunks():
+        yield "".join(json.dumps(row, default=_json_default) + "\n" for row in rows).encode("utf-8")
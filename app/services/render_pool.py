@@ -0,0 +1,266 @@
+import asyncio
+import concurrent.futures
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+from dotenv import load_dotenv
+
+from app.utils.shared_slots import SharedSlots
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+RENDER_POOL_WORKERS = int(os.getenv("RENDER_POOL_WORKERS", str(os.cpu_count() or 2)))
+
+# Jobs a worker process runs before it is replaced by a fresh one
+RENDER_JOBS_PER_WORKER = int(os.getenv("RENDER_JOBS_PER_WORKER", "50"))
+
+# Jobs allowed to wait for a free worker before new ones are rejected
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "32"))
+
+# Wall-clock and CPU seconds a single job may use
+RENDER_JOB_TIMEOUT = float(os.getenv("RENDER_JOB_TIMEOUT", "30"))
+RENDER_JOB_CPU_SECONDS = int(os.getenv("RENDER_JOB_CPU_SECONDS", "20"))
+
+# Address space limit of a worker process in MB, 0 disables it
+RENDER_WORKER_MEMORY_MB = int(os.getenv("RENDER_WORKER_MEMORY_MB", "2048"))
+
+# Extra time the API process waits past the job timeout before killing the workers
+HARD_TIMEOUT_GRACE = 5.0
+
+# Times a job is submitted again after a worker died or the pool was restarted under it
+RENDER_POOL_RESUBMITS = 1
+
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError("Plot rendering exceeded its time limit.")
+
+
+def _init_worker(memory_mb):
+    """
+    Prepare a worker process: limits, signal handlers and the plotting imports,
+    so the first job does not pay for loading Matplotlib and Seaborn.
+    """
+    # One BLAS thread per worker, the pool itself provides the parallelism
+    os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+    import matplotlib.pyplot  # noqa: F401
+    import pandas  # noqa: F401
+    import seaborn  # noqa: F401
+
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.signal(signal.SIGXCPU, _raise_timeout)
+
+
+def _warmup():
+    return os.getpid()
+
+
+def _render_job(plot_code, result, timeout, cpu_seconds, options=None):
+    """
+    Execute AI-generated plot code in a worker process and return the encoded image bytes.
+    Columnar results are sent to the worker as arrays and turned into rows there.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    from app.utils.image_options import save_figure
+
+    _, cpu_hard_limit = resource.getrlimit(resource.RLIMIT_CPU)
+
+    # Per-job limits: an alarm for wall-clock time, and a soft CPU limit relative to what this worker already used
+    signal.alarm(max(1, math.ceil(timeout)))
+    if cpu_seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        resource.setrlimit(
+            resource.RLIMIT_CPU, (math.ceil(usage.ru_utime + usage.ru_stime) + cpu_seconds, cpu_hard_limit)
+        )
+
+    try:
+        plt.close("all")
+
+        # The plot code expects a list of row dictionaries
+        if hasattr(result, "to_rows"):
+            result = result.to_rows()
+
+        exec_globals = {
+            "plt": plt,
+            "sns": sns,
+            "result": result,  # Pass `result` which the AI-generated code expects
+        }
+        exec(plot_code, exec_globals)
+
+        if not plt.get_fignums():
+            raise ValueError("No figure was generated by the plotting code.")
+
+        return save_figure(plt.gcf(), options)
+
+    finally:
+        signal.alarm(0)
+        if cpu_seconds:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_hard_limit, cpu_hard_limit))
+        plt.close("all")
+
+
+class RenderPool:
+    """
+    Pool of pre-warmed worker processes that execute plot code with the Agg backend,
+    each job under a wall-clock timeout, a CPU limit and the worker's memory limit.
+    """
+
+    def __init__(
+        self,
+        workers=RENDER_POOL_WORKERS,
+        jobs_per_worker=RENDER_JOBS_PER_WORKER,
+        queue_size=RENDER_QUEUE_SIZE,
+        memory_mb=RENDER_WORKER_MEMORY_MB,
+    ):
+        self.workers = workers
+        self.jobs_per_worker = jobs_per_worker
+        self.memory_mb = memory_mb
+        # Admission control for running and waiting jobs, and the jobs handed to the executor.
+        # Jobs wait here rather than in the executor so their timeout only counts while they run.
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._running = SharedSlots(workers)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _create_executor(self):
+        # spawn: forking the threaded API process is unsafe, and max_tasks_per_child requires it
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.memory_mb,),
+            max_tasks_per_child=self.jobs_per_worker,
+        )
+
+    def start(self):
+        """
+        Start the worker processes and wait until each of them is ready.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+            executor = self._executor
+
+        warmups = [executor.submit(_warmup) for _ in range(self.workers)]
+        concurrent.futures.wait(warmups)
+        logger.info(f"Render pool started with {self.workers} workers.")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+            return self._executor
+
+    def _replace_executor(self, executor):
+        """
+        Kill the workers of a broken or stuck executor and start a new one. A dead worker
+        breaks the whole ProcessPoolExecutor, so the jobs other workers were running fail
+        with BrokenProcessPool and are submitted again by render().
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = self._create_executor()
+
+        # ProcessPoolExecutor has no public way to kill a worker stuck outside Python code
+        for process in list((executor._processes or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run_job(self, plot_code, result, timeout, options):
+        """
+        Run one job on the current executor while holding a running slot, and return its image bytes.
+        When the caller is cancelled the slot is kept until the worker is done with the job.
+        """
+        await self._running.acquire_async()
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_render_job, plot_code, result, timeout, RENDER_JOB_CPU_SECONDS, options)
+        except BrokenProcessPool:
+            self._running.release()
+            self._replace_executor(executor)
+            raise
+        future.add_done_callback(lambda _: self._running.release())
+
+        # Awaited on the event loop, no thread is blocked while the worker renders. A job that hit
+        # its own limits finishes with TimeoutError; one that is still running after the grace
+        # period is stuck where the alarm cannot interrupt it
+        waiter = asyncio.wrap_future(future)
+        try:
+            done, _ = await asyncio.wait([waiter], timeout=timeout + HARD_TIMEOUT_GRACE)
+        finally:
+            # The outcome is read from the job's future, the waiter only wakes this task. Cancelling it
+            # drops the job when it did not start yet, and retrieving its exception keeps asyncio quiet
+            if not waiter.done():
+                waiter.cancel()
+            elif not waiter.cancelled():
+                waiter.exception()
+
+        if not done:
+            logger.error("Render worker did not respond after its timeout, restarting the pool.")
+            self._replace_executor(executor)
+            raise TimeoutError("Plot rendering exceeded its time limit.")
+
+        # Jobs still waiting in the executor are cancelled when it is replaced
+        if future.cancelled():
+            raise BrokenProcessPool("The render pool was restarted before the job started.")
+
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            logger.error("Render worker died, restarting the pool.")
+            self._replace_executor(executor)
+            raise
+
+    async def render(self, plot_code, result, timeout=RENDER_JOB_TIMEOUT, options=None):
+        """
+        Render plot code in a worker process and return the image bytes, encoded with
+        the given ImageOptions or as a PNG at the default resolution.
+
+        Raises:
+            queue.Full: When all workers are busy and the wait queue is full.
+            TimeoutError: When the job exceeded its time or CPU limit.
+            BrokenProcessPool: When the pool was restarted under the job more than RENDER_POOL_RESUBMITS times.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise queue.Full("The plot rendering queue is full.")
+
+        try:
+            for attempt in range(RENDER_POOL_RESUBMITS + 1):
+                try:
+                    return await self._run_job(plot_code, result, timeout, options)
+                except BrokenProcessPool:
+                    if attempt == RENDER_POOL_RESUBMITS:
+                        raise
+                    logger.warning("Render pool was restarted while the job ran, submitting it again.")
+        finally:
+            self._slots.release()
+
+
+render_pool = RenderPool()
@@ -0,0 +1,228 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+from dataclasses import astuple, dataclass
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from app.services.chart_templates import pick_template, render_chart_template
+from app.services.query_chain import (
+    generate_plot_code_from_ai,
+    generate_sql_and_execute,
+    invalidate_plot_code,
+    remember_plot_code,
+)
+from app.services.visualization_service import execute_plot_code
+from app.utils.cache import TTLCache
+from app.utils.columnar import ColumnarResult
+from app.utils.image_options import DEFAULT_IMAGE_OPTIONS
+from app.utils.metrics import register_cache
+from app.utils.sql_utils import convert_decimal_to_float, result_columns, result_fingerprint
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Rows sent with the "rows" progress event, before the chart is ready
+PREVIEW_ROWS = int(os.getenv("VISUALIZATION_PREVIEW_ROWS", "20"))
+
+
+# Encoded charts, keyed by their ETag: what drew them, the data they show and the image options
+image_cache = TTLCache(
+    max_entries=int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "512")),
+    ttl=float(os.getenv("IMAGE_CACHE_TTL", "3600")),
+    max_bytes=int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(128 * 1024 * 1024))),
+    sizeof=len,
+)
+register_cache("image", image_cache)
+
+
+@dataclass
+class RenderedImage:
+    content: bytes
+    media_type: str
+    etag: str
+
+
+def image_etag(renderer, data_hash, options):
+    """
+    ETag of a chart: the hash of what draws it (plot code or template), the hash of its data
+    and the image options. The same inputs always produce the same image.
+    """
+    return hashlib.sha256(repr((renderer, data_hash, astuple(options))).encode("utf-8")).hexdigest()
+
+
+async def render_cached(etag, render):
+    """
+    Return the cached image for an ETag, or await `render()` (returning a buffer or None) and cache its bytes.
+    """
+    image = image_cache.get(etag)
+    if image is not None:
+        logger.info("Using cached rendered image.")
+        return image
+
+    buf = await render()
+    if buf is None:
+        return None
+
+    image = buf.getvalue()
+    image_cache.set(etag, image)
+    return image
+
+
+async def _ignore_event(event, data):
+    pass
+
+
+async def run_visualization_pipeline(question, engine, use_templates=True, on_event=None, options=DEFAULT_IMAGE_OPTIONS):
+    """
+    Answer a question with a chart: generate and run the SQL, then draw the result with a
+    template or with AI-generated plot code.
+
+    Args:
+        question (str): The user's natural language question.
+        engine: The SQLAlchemy engine of the connected database.
+        use_templates (bool): Draw common chart types from templates instead of asking the LLM for code.
+        on_event: Optional coroutine function called with an event name and its data as each
+            stage completes: "sql", "rows", "chart_type", "plot_code" when code was generated and
+            "render" once the image is drawn. The "token"s of generated plot code arrive as they stream.
+        options (ImageOptions): Format, resolution and size of the image.
+
+    Returns:
+        RenderedImage: The encoded chart, its media type and its ETag.
+    """
+    # Step 1: Log after invoking the LLM for SQL generation
+    logger.info(f"Invoking Groq LLM for SQL generation with question: {question}")
+
+    sql_result = await generate_sql_and_execute(question, engine)
+
+    if not sql_result or not sql_result.get("response"):
+        logger.warning(f"No data found for the query: {question}")
+        raise HTTPException(status_code=404, detail="No data found for the query.")
+
+    emit = on_event or _ignore_event
+    await emit("sql", {"sql": sql_result["response"]})
+
+    # Convert Decimal type float in result
+    sql_result["result"] = await run_in_threadpool(convert_decimal_to_float, sql_result["result"])
+    logger.info(f"SQL result (after converting Decimal): {sql_result['result']}")
+
+    # Step 2: Log SQL query and execution result
+    logger.info(f"Generated SQL query: {sql_result['response']}")
+    logger.info(f"SQL Query result: {sql_result['result']}")
+
+    result = sql_result["result"]
+    preview = result[:PREVIEW_ROWS]
+    await emit(
+        "rows",
+        {
+            "row_count": len(result),
+            "columns": result_columns(result),
+            "rows": preview.to_rows() if isinstance(preview, ColumnarResult) else preview,
+        },
+    )
+
+    data_hash = await run_in_threadpool(result_fingerprint, result)
+
+    # Step 3: Common charts are drawn directly from the result, without generating code
+    if use_templates:
+        template = await run_in_threadpool(pick_template, result, question)
+
+        if template is not None:
+            await emit("chart_type", {"chart_type": template["chart_type"], "renderer": "template"})
+
+            # The question is drawn as the chart title
+            etag = image_etag(("template", template, question), data_hash, options)
+            image = await render_cached(
+                etag, lambda: run_in_threadpool(render_chart_template, result, question, template, options)
+            )
+
+            if image is not None:
+                logger.info("Plot generated successfully from template")
+                await emit("render", {"renderer": "template", "bytes": len(image)})
+                return RenderedImage(image, options.media_type, etag)
+
+    # Log after generating python code for visualization
+    logger.info("Generating Python code for visualization.")
+
+    # Generate Python code for the visualization from the AI
+    plot_code = await generate_plot_code_from_ai(result, question, on_event=on_event)
+
+    if not plot_code or not plot_code.code:
+        logger.error("Failed to generate python code for visualization")
+        raise HTTPException(status_code=500, detail="Failed to generate Python code for visualization.")
+
+    logger.info(f"Generated Python plot code: {plot_code.code}")
+    await emit("plot_code", {"cached": plot_code.cached})
+
+    # Step 4: Log after executing the generated plot code
+    etag = image_etag(plot_code.code, data_hash, options)
+    image = await render_cached(etag, lambda: execute_plot_code(plot_code.code, result, options))
+
+    # Cached code that no longer renders is evicted and generated again once; new code that fails is not retried
+    if image is None and plot_code.cached:
+        logger.warning("Cached plot code failed to render, generating new code.")
+        invalidate_plot_code(plot_code)
+        plot_code = await generate_plot_code_from_ai(result, question, use_cache=False, on_event=on_event)
+        await emit("plot_code", {"cached": plot_code.cached})
+        etag = image_etag(plot_code.code, data_hash, options)
+        image = await render_cached(etag, lambda: execute_plot_code(plot_code.code, result, options))
+
+    if image is None:
+        logger.error("Failed to generate the plot buffer.")
+        raise HTTPException(status_code=500, detail="Failed to generate the plot image.")
+
+    await emit("render", {"renderer": "generated_code", "bytes": len(image)})
+
+    # Only code that rendered is cached for the next request
+    await remember_plot_code(plot_code)
+
+    logger.info("Plot generated successfully")
+    return RenderedImage(image, options.media_type, etag)
+
+
+async def visualization_events(question, engine, use_templates=True, options=DEFAULT_IMAGE_OPTIONS):
+    """
+    Run the visualization pipeline and yield `(event, data)` pairs as its stages complete,
+    ending with an "image" event holding the base64 encoded image, or an "error" event.
+
+    Closing the generator, e.g. when the client disconnects, cancels the pipeline.
+    """
+    queue = asyncio.Queue()
+    done = object()
+
+    async def on_event(event, data):
+        await queue.put((event, data))
+
+    async def run():
+        try:
+            image = await run_visualization_pipeline(question, engine, use_templates, on_event, options)
+            data = base64.b64encode(image.content).decode("ascii")
+            await queue.put(("image", {"media_type": image.media_type, "etag": image.etag, "data": data}))
+
+        except HTTPException as e:
+            await queue.put(("error", {"error": e.detail, "status_code": e.status_code}))
+
+        except Exception as e:
+            logger.error(f"Visualization pipeline failed: {str(e)}")
+            await queue.put(("error", {"error": str(e), "status_code": 500}))
+
+        finally:
+            await queue.put(done)
+
+    task = asyncio.create_task(run())
+
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        if not task.done():
+            logger.info("Visualization stream closed early, cancelling the pipeline.")
+        task.cancel()
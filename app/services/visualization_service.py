@@ -1,24 +1,32 @@
 import logging
-import matplotlib.pyplot as plt
-import seaborn as sns
+import queue
 from io import BytesIO
 import traceback
 
+from fastapi import HTTPException, status
+
+from app.services.render_pool import render_pool
+from app.utils.metrics import record_image_size, timed
+
 logger = logging.getLogger(__name__)
 
 
-def execute_plot_code(plot_code: str, results):
+@timed("execute_plot_code")
+async def execute_plot_code(plot_code: str, results, options=None):
     """
-        Executes the AI-generated Python plot code, passes the SQL result data, and returns the generated plot as a buffer.
+        Executes the AI-generated Python plot code in the render worker pool, passes the SQL result data, and returns the generated plot as a buffer.
 
         Args:
             plot_code (str): The Python code generated by the AI to create the plot.
-            results (list[dict]): The SQL result data passed to the plot code.
+            results (ColumnarResult | list[dict]): The SQL result data passed to the plot code.
+            options (ImageOptions): Format, resolution and size of the image, a default PNG when not given.
 
         Returns:
-            BytesIO: A buffer containing the plot image in PNG format, or None if there was an error.
+            BytesIO: A buffer containing the plot image, or None if there was an error.
+
+        Raises:
+            HTTPException: 503 when the render queue is full.
     """
-    buf = BytesIO()
     try:
         # Convert results to a format that the plot code expects
         result = results  # Rename `results` to `result` for compatibility with the AI-generated code
@@ -28,26 +36,19 @@ def execute_plot_code(plot_code: str, results):
 
         logger.info(f"Data Columns for plotting: {list(result[0].keys())}")  # Log the data columns for reference
 
-        # Set up execution environment and pass the results as `result`
-        exec_globals = {
-            'plt': plt,
-            'sns': sns,
-            'result': result  # Pass `result` which the AI-generated code expects
-        }
-
-        # Attempt to execute the AI-generated plot code
+        # Run the plot code in an isolated worker process, under its time, CPU and memory limits
         logger.info(f"Executing AI-generated plot code:\n{plot_code}")
-        exec(plot_code, exec_globals)  # Run the plot code in a controlled environment
+        image = await render_pool.render(plot_code, result, options=options)
+        record_image_size(len(image))
 
-        # Check if a figure has been created and save it to a buffer
-        if plt.get_fignums():  # Check if any figure was generated
-            plt.savefig(buf, format='png')  # Save the figure to the buffer
-            plt.close('all')  # Close the plot to free up resources
-            buf.seek(0)  # Move to the start of the buffer
-            return buf  # Return the buffer containing the plot image
+        return BytesIO(image)  # Return the buffer containing the plot image
 
-        else:
-            raise Exception("No figure was generated by the plotting code.")
+    except queue.Full:
+        logger.warning("Plot rendering queue is full, rejecting the request.")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many visualizations are being rendered. Please try again shortly.",
+        )
 
     except Exception as e:
         # Log the detailed traceback for debugging
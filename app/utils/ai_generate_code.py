@@ -1,27 +1,22 @@
 from sqlalchemy import text
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
 import os
 from langchain_core.prompts import PromptTemplate
 
+from app.services.llm_gateway import get_llm, llm_gateway
 from app.utils.clean_ai_plot_code import clean_ai_plot_code
+from app.utils.prompt_encoding import encode_result_for_prompt
 
 load_dotenv()
 
 # Get the api key from the environment
 api_key = os.getenv("GROQ_API_KEY")
 
-groq_llm = ChatGroq(
-    model="llama3-groq-8b-8192-tool-use-preview",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-)
+groq_llm = get_llm("llama3-groq-8b-8192-tool-use-preview", temperature=0)
 
 
 def get_ai_plot_code(db_type, question, results):
-    result_str = str(results)
+    result_str = encode_result_for_prompt(results)
 
     print("Result of queries execution ", result_str)
     # Use the AI to generate Python code for plotting the database
@@ -30,7 +25,7 @@ def get_ai_plot_code(db_type, question, results):
     Your task is to generate **only** the Python code using Matplotlib or Seaborn to create a plot that visualizes this data based on the user's question: {question}.
     Do NOT include any comments, explanations, or extra text like "Here's the code." Return only the Python code, and nothing else.
     """
-    code_response = groq_llm.invoke(generate_code_prompt)
+    code_response = llm_gateway.invoke(groq_llm, generate_code_prompt)
 
     print("RAW AI response : ", code_response.content)
 
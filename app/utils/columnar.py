@@ -0,0 +1,162 @@
+import sys
+from decimal import Decimal
+
+import numpy as np
+
+# Rows fetched from the cursor at a time while building the columns
+FETCH_CHUNK_SIZE = 10000
+
+# NumPy dtype kind expected for a column of Python ints, floats or bools
+NUMPY_KINDS = {int: "i", float: "f", bool: "b"}
+
+
+def _to_array(values):
+    """
+    Store a column's values in the most compact NumPy array that keeps them exact:
+    int64, float64 or bool when the column has one such type and no NULLs, object otherwise.
+    """
+    first = next((v for v in values if v is not None), None)
+
+    if type(first) in (int, float, bool):
+        # NumPy falls back to an object array for NULLs and integers beyond 64 bits
+        array = np.array(values)
+        if array.ndim == 1 and array.dtype.kind == NUMPY_KINDS[type(first)]:
+            return array
+
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+class ColumnarResult:
+    """
+    A SQL result stored column by column: the column names once and one NumPy array per column.
+
+    It can be used where a list of row dictionaries is expected: len(), indexing and iteration
+    give dictionary rows, built on access. Whole-column access (`column_values`, `to_dataframe`)
+    avoids the per-row objects entirely.
+    """
+
+    def __init__(self, columns, arrays):
+        self.columns = list(columns)
+        self.arrays = list(arrays)
+        self.length = len(self.arrays[0]) if self.arrays else 0
+        # With duplicate column names the last one wins, as in the dictionary rows
+        self._positions = {name: i for i, name in enumerate(self.columns)}
+
+    @classmethod
+    def from_cursor(cls, result, chunk_size=FETCH_CHUNK_SIZE):
+        """
+        Build a columnar result from a SQLAlchemy result, fetching `chunk_size` rows at a time
+        so the row tuples of the whole result are never held in memory together.
+        """
+        columns = list(result.keys())
+        values = [[] for _ in columns]
+
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            for column_values, chunk_values in zip(values, zip(*rows)):
+                column_values.extend(chunk_values)
+
+        return cls(columns, [_to_array(column_values) for column_values in values])
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build a columnar result from a list of dictionaries with the same keys.
+        """
+        if not rows:
+            return cls([], [])
+
+        columns = list(rows[0].keys())
+        return cls(columns, [_to_array([row.get(column) for row in rows]) for column in columns])
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ColumnarResult(self.columns, [array[index] for array in self.arrays])
+
+        values = (array[index] if array.dtype == object else array[index].item() for array in self.arrays)
+        return dict(zip(self.columns, values))
+
+    def __iter__(self):
+        lists = [array.tolist() for array in self.arrays]
+        for values in zip(*lists):
+            yield dict(zip(self.columns, values))
+
+    def __repr__(self):
+        return f"ColumnarResult({self.length} rows, columns={self.columns})"
+
+    def __getstate__(self):
+        return {"columns": self.columns, "arrays": self.arrays}
+
+    def __setstate__(self, state):
+        self.__init__(state["columns"], state["arrays"])
+
+    def copy(self):
+        """
+        A shallow copy: the arrays are shared, but converting the copy's columns
+        replaces its arrays without touching the original's.
+        """
+        return ColumnarResult(self.columns, self.arrays)
+
+    def column_values(self, name):
+        """
+        The values of one column as a list of Python objects.
+        """
+        return self.arrays[self._positions[name]].tolist()
+
+    def convert_decimals(self):
+        """
+        Convert Decimal columns to float in place, one vectorized cast per column.
+        Columns with NULLs keep None where the value is NULL.
+        """
+        for i, array in enumerate(self.arrays):
+            if array.dtype != object:
+                continue
+
+            first = next((v for v in array if v is not None), None)
+            if not isinstance(first, Decimal):
+                continue
+
+            nulls = np.equal(array, None)
+            present = array[~nulls]
+
+            if not nulls.any():
+                self.arrays[i] = array.astype(np.float64)
+            else:
+                converted = array.copy()
+                converted[~nulls] = present.astype(np.float64)
+                self.arrays[i] = converted
+
+        return self
+
+    def to_rows(self):
+        """
+        The result as a list of dictionaries of Python values, e.g. for a JSON response.
+        """
+        return list(self)
+
+    def to_dataframe(self):
+        import pandas as pd
+
+        return pd.DataFrame({name: self.arrays[i] for name, i in self._positions.items()}, columns=list(self._positions))
+
+    @property
+    def nbytes(self):
+        """
+        Approximate memory used by the column data, including the objects referenced by object columns.
+        """
+        size = 0
+        for array in self.arrays:
+            size += array.nbytes
+            if array.dtype == object:
+                size += sum(sys.getsizeof(value) for value in array)
+        return size
@@ -0,0 +1,66 @@
+import os
+from dataclasses import dataclass
+from io import BytesIO
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Output formats a chart can be requested in, and their media types
+IMAGE_MEDIA_TYPES = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+}
+
+IMAGE_DEFAULT_DPI = int(os.getenv("IMAGE_DEFAULT_DPI", "100"))
+IMAGE_MIN_DPI = 30
+IMAGE_MAX_DPI = 300
+
+# Largest width or height in pixels a client may ask for
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "4000"))
+
+# Lossy formats trade a little quality for much smaller dashboard payloads
+LOSSY_QUALITY = int(os.getenv("IMAGE_LOSSY_QUALITY", "85"))
+
+
+@dataclass(frozen=True)
+class ImageOptions:
+    """
+    How a chart is encoded: the format, the resolution, and optionally the size in pixels.
+    With only one of width and height given, the figure keeps its aspect ratio.
+    """
+
+    format: str = "png"
+    dpi: int = IMAGE_DEFAULT_DPI
+    width: int | None = None
+    height: int | None = None
+
+    @property
+    def media_type(self):
+        return IMAGE_MEDIA_TYPES[self.format]
+
+
+DEFAULT_IMAGE_OPTIONS = ImageOptions()
+
+
+def save_figure(fig, options=None):
+    """
+    Encode a Matplotlib figure with the given image options and return the bytes.
+    """
+    options = options or DEFAULT_IMAGE_OPTIONS
+
+    if options.width or options.height:
+        width_inches, height_inches = fig.get_size_inches()
+        width = options.width or options.height * width_inches / height_inches
+        height = options.height or options.width * height_inches / width_inches
+        fig.set_size_inches(width / options.dpi, height / options.dpi)
+
+    save_options = {}
+    if options.format in ("jpeg", "webp"):
+        save_options["pil_kwargs"] = {"quality": LOSSY_QUALITY}
+
+    buf = BytesIO()
+    fig.savefig(buf, format=options.format, dpi=options.dpi, **save_options)
+    return buf.getvalue()
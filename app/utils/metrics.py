@@ -0,0 +1,186 @@
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Latency buckets from fast local stages (parsing, templates) up to slow LLM calls
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_DURATION = Histogram(
+    "nlp2sql_stage_duration_seconds",
+    "Duration of a pipeline stage.",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+STAGE_ERRORS = Counter("nlp2sql_stage_errors_total", "Pipeline stages that raised an exception.", ["stage"])
+COALESCED = Counter(
+    "nlp2sql_coalesced_requests_total", "Requests answered by an identical request already in flight.", ["endpoint"]
+)
+JOBS = Counter("nlp2sql_jobs_total", "Background visualization jobs that finished.", ["status"])
+JOB_QUEUE_DEPTH = Gauge("nlp2sql_job_queue_depth", "Background visualization jobs waiting for a worker.")
+RETRIES = Counter("nlp2sql_retries_total", "Attempts retried after a failure.", ["stage"])
+LLM_TOKENS = Counter("nlp2sql_llm_tokens_total", "Tokens sent to and received from the LLM.", ["stage", "kind"])
+RESULT_ROWS = Histogram(
+    "nlp2sql_result_rows",
+    "Rows returned by executed SQL queries.",
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000, 1000000),
+)
+RESULT_BYTES = Histogram(
+    "nlp2sql_result_bytes",
+    "Approximate memory size of SQL query results.",
+    buckets=(1024, 16384, 131072, 1048576, 8388608, 67108864, 268435456),
+)
+IMAGE_BYTES = Histogram(
+    "nlp2sql_image_bytes",
+    "Size of rendered chart images.",
+    buckets=(16384, 65536, 131072, 262144, 524288, 1048576, 4194304),
+)
+
+
+@contextmanager
+def track_stage(stage):
+    """
+    Time the enclosed block as a pipeline stage and count it as an error when it raises.
+    Works around `await` expressions too.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_DURATION.labels(stage).observe(time.perf_counter() - started)
+
+
+def timed(stage):
+    """
+    Decorator that tracks every call of a function, sync or async, as a pipeline stage.
+    """
+
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with track_stage(stage):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with track_stage(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_retry(stage):
+    RETRIES.labels(stage).inc()
+
+
+def record_coalesced(endpoint):
+    COALESCED.labels(endpoint).inc()
+
+
+def record_job(status):
+    JOBS.labels(status).inc()
+
+
+def record_result_size(rows):
+    if rows is None:
+        return
+    RESULT_ROWS.observe(len(rows))
+    nbytes = getattr(rows, "nbytes", None)
+    if nbytes is not None:
+        RESULT_BYTES.observe(nbytes)
+
+
+def record_image_size(size):
+    IMAGE_BYTES.observe(size)
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """
+    LangChain callback that counts the prompt and completion tokens reported by the LLM,
+    for chains whose output no longer carries the message's usage metadata.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def on_llm_end(self, response, **kwargs):
+        input_tokens = output_tokens = 0
+
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+
+        # Older integrations only report the usage in llm_output
+        if not input_tokens and not output_tokens and response.llm_output:
+            usage = response.llm_output.get("token_usage") or {}
+            input_tokens = usage.get("prompt_tokens", 0)
+            output_tokens = usage.get("completion_tokens", 0)
+
+        if input_tokens:
+            LLM_TOKENS.labels(self.stage, "prompt").inc(input_tokens)
+        if output_tokens:
+            LLM_TOKENS.labels(self.stage, "completion").inc(output_tokens)
+
+
+def llm_config(stage):
+    """
+    Runnable config that records the token usage of an LLM call under `stage`.
+    """
+    return {"callbacks": [TokenUsageCallback(stage)]}
+
+
+class CacheCollector:
+    """
+    Exposes the hit, miss and size counters of the application's TTL caches,
+    read from their stats() when Prometheus scrapes.
+    """
+
+    def __init__(self):
+        self.caches = {}
+
+    def register(self, name, cache):
+        self.caches[name] = cache
+
+    def collect(self):
+        hits = CounterMetricFamily("nlp2sql_cache_hits", "Cache lookups that found a value.", labels=["cache"])
+        misses = CounterMetricFamily("nlp2sql_cache_misses", "Cache lookups that found nothing.", labels=["cache"])
+        evictions = CounterMetricFamily("nlp2sql_cache_evictions", "Entries evicted from a cache.", labels=["cache"])
+        entries = GaugeMetricFamily("nlp2sql_cache_entries", "Entries in a cache.", labels=["cache"])
+        size = GaugeMetricFamily("nlp2sql_cache_bytes", "Memory size of a cache's values.", labels=["cache"])
+
+        for name, cache in list(self.caches.items()):
+            stats = cache.stats()
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            evictions.add_metric([name], stats["evictions"])
+            entries.add_metric([name], stats["entries"])
+            size.add_metric([name], stats["bytes"])
+
+        return [hits, misses, evictions, entries, size]
+
+
+cache_collector = CacheCollector()
+REGISTRY.register(cache_collector)
+
+
+def register_cache(name, cache):
+    """
+    Export a TTLCache's statistics on the /metrics endpoint.
+    """
+    cache_collector.register(name, cache)
@@ -0,0 +1,98 @@
+import os
+from collections import Counter
+from datetime import date, datetime, time
+
+from dotenv import load_dotenv
+
+from app.utils.sql_utils import column_kind, column_values, result_columns
+
+load_dotenv()
+
+# Rough size limit for a query result embedded in an LLM prompt
+PROMPT_RESULT_TOKEN_BUDGET = int(os.getenv("PROMPT_RESULT_TOKEN_BUDGET", "1500"))
+
+# Common approximation for English text and SQL output
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _format_value(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    return str(value).replace("\n", " ")
+
+
+def encode_rows(result, columns, max_chars=None):
+    """
+    Encode rows as a header line followed by one '|'-separated line per row, so
+    column names appear once instead of on every row.
+    Returns None when the encoding would exceed `max_chars`.
+    """
+    lines = [" | ".join(columns)]
+    size = len(lines[0])
+
+    for row in result:
+        line = " | ".join(_format_value(row.get(column)) for column in columns)
+        size += len(line) + 1
+        if max_chars is not None and size > max_chars:
+            return None
+        lines.append(line)
+
+    return "\n".join(lines)
+
+
+def summarize_result(result, columns, sample_rows=5, top_n=5):
+    """
+    Describe a result too large for a prompt: row count, and for every column its
+    kind, distinct and null counts, min/max or most frequent values, plus a few sample rows.
+    """
+    lines = [f"{len(result)} rows, {len(columns)} columns (summary, not the full data):"]
+
+    for column in columns:
+        values = column_values(result, column)
+        non_null = [v for v in values if v is not None]
+        kind = column_kind(non_null)
+
+        counts = Counter(_format_value(v) for v in non_null)
+        line = f"- {column}: {kind}, {len(counts)} distinct, {len(values) - len(non_null)} null"
+
+        if kind in ("numeric", "temporal"):
+            try:
+                line += f", min {_format_value(min(non_null))}, max {_format_value(max(non_null))}"
+            except TypeError:
+                # e.g. dates mixed with datetimes, which do not compare
+                pass
+        if kind in ("text", "boolean") or len(counts) <= top_n:
+            top_values = ", ".join(f"{value} ({count})" for value, count in counts.most_common(top_n))
+            line += f", top values: {top_values}"
+
+        lines.append(line)
+
+    lines.append(f"First {min(sample_rows, len(result))} rows:")
+    lines.append(encode_rows(result[:sample_rows], columns))
+
+    return "\n".join(lines)
+
+
+def encode_result_for_prompt(result, token_budget=PROMPT_RESULT_TOKEN_BUDGET):
+    """
+    Encode a SQL result (list of dictionaries) for an LLM prompt: the full rows in a
+    columnar layout when they fit the token budget, otherwise a summary with sample rows.
+    """
+    if not result:
+        return "(no rows)"
+
+    columns = result_columns(result)
+
+    encoded = encode_rows(result, columns, max_chars=token_budget * CHARS_PER_TOKEN)
+    if encoded is not None:
+        return f"{len(result)} rows:\n{encoded}"
+
+    return summarize_result(result, columns)
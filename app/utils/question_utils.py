@@ -0,0 +1,24 @@
+import re
+
+# Quoted literals such as 'Product XX' are kept verbatim, they end up in SQL string comparisons
+QUOTED_LITERAL_PATTERN = re.compile(r"((?<!\w)'[^']*'(?!\w)|(?<!\w)\"[^\"]*\"(?!\w))")
+
+# Sentence punctuation closing the question, which does not change what is asked
+TRAILING_PUNCTUATION_PATTERN = re.compile(r"[\s?!.]+$")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalize a user's question for use as a cache key: lower case, whitespace collapsed
+    and closing punctuation removed, except inside quoted literals. Operators, signs and
+    decimal points are kept, so "sales > 100" and "sales < 100" stay different questions.
+    """
+    parts = []
+    for part in QUOTED_LITERAL_PATTERN.split(question or ""):
+        if QUOTED_LITERAL_PATTERN.fullmatch(part):
+            parts.append(part)
+            continue
+
+        parts.append(re.sub(r"\s+", " ", part.lower()))
+
+    return TRAILING_PUNCTUATION_PATTERN.sub("", "".join(parts).strip())
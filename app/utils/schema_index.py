@@ -0,0 +1,118 @@
+import math
+import os
+import re
+from collections import Counter
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Tables picked by relevance for a question, the tables their foreign keys point to are added on top
+SCHEMA_PRUNE_TOP_K = int(os.getenv("SCHEMA_PRUNE_TOP_K", "8"))
+
+# Schemas with at most this many tables are always sent to the LLM whole
+SCHEMA_PRUNE_MIN_TABLES = int(os.getenv("SCHEMA_PRUNE_MIN_TABLES", "12"))
+
+# Table name terms count more than column terms, they describe what the table is about
+TABLE_NAME_WEIGHT = 3
+REFERENCED_TABLE_WEIGHT = 1
+
+# Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+CAMEL_CASE_PATTERN = re.compile(r"([a-z0-9])([A-Z])")
+TERM_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def _stem(term):
+    # Plural and singular forms must match: "customers" asks about the customer table
+    if len(term) > 4 and term.endswith("ies"):
+        return term[:-3] + "y"
+    if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+        return term[:-1]
+    return term
+
+
+def tokenize(text):
+    """
+    Split a question or identifier into stemmed lower-case terms, also at
+    underscores and camelCase boundaries (e.g. 'orderItems' -> ['order', 'item']).
+    """
+    text = CAMEL_CASE_PATTERN.sub(r"\1 \2", text or "").replace("_", " ").lower()
+    return [_stem(term) for term in TERM_PATTERN.findall(text)]
+
+
+class SchemaIndex:
+    """
+    BM25 index over the tables of a reflected schema. Each table is a document made of
+    its name, its column names and the names of the tables its foreign keys point to.
+    """
+
+    def __init__(self, schema):
+        # Tables each table's foreign keys point to. Only these parents are pulled into the prompt:
+        # following references the other way would add every table referencing a hub like users
+        self.referenced = {table_name: set() for table_name in schema}
+        documents = {}
+
+        for table_name, table in schema.items():
+            terms = tokenize(table_name) * TABLE_NAME_WEIGHT
+            for column in table["columns"]:
+                terms += tokenize(column["name"])
+
+            for fk in table.get("foreign_keys", []):
+                referred_table = fk["referred_table"]
+                terms += tokenize(referred_table) * REFERENCED_TABLE_WEIGHT
+                if referred_table in self.referenced and referred_table != table_name:
+                    self.referenced[table_name].add(referred_table)
+
+            documents[table_name] = Counter(terms)
+
+        self.lengths = {table_name: sum(terms.values()) for table_name, terms in documents.items()}
+        self.average_length = sum(self.lengths.values()) / len(documents) if documents else 0
+
+        # Inverted index: term -> {table name: term frequency}
+        self.postings = {}
+        for table_name, terms in documents.items():
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, {})[table_name] = frequency
+
+        total = len(documents)
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def score(self, question):
+        """
+        Return the BM25 score of every table matching at least one term of the question.
+        """
+        scores = Counter()
+
+        for term in set(tokenize(question)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+
+            idf = self.idf[term]
+            for table_name, frequency in postings.items():
+                norm = 1 - BM25_B + BM25_B * self.lengths[table_name] / self.average_length
+                scores[table_name] += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * norm)
+
+        return scores
+
+    def relevant_tables(self, question, top_k=SCHEMA_PRUNE_TOP_K):
+        """
+        Return the `top_k` tables most relevant to the question plus the tables their foreign
+        keys point to, or an empty list when no table matches. The result grows with the
+        foreign keys of the matched tables, not with how often a table is referenced.
+        """
+        ranked = [table_name for table_name, _ in self.score(question).most_common(top_k)]
+
+        tables = list(ranked)
+        for table_name in ranked:
+            for referenced_table in sorted(self.referenced[table_name]):
+                if referenced_table not in tables:
+                    tables.append(referenced_table)
+
+        return tables
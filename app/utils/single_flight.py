@@ -0,0 +1,45 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts the work and
+    every caller arriving while it runs awaits the same task and gets its result or exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, function):
+        """
+        Run `function()` (a coroutine function) for `key`, or join the run already in flight.
+
+        Returns:
+            tuple: The result and whether it was shared from another caller's run.
+        """
+        task = self._calls.get(key)
+        shared = task is not None
+
+        if not shared:
+            task = asyncio.create_task(function())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            logger.info("Joining an identical request already in flight.")
+
+        # A caller that disconnects must not cancel the run the other callers are waiting on
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+        # Mark the exception as retrieved, every waiter may have gone away before the run ended
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self):
+        return len(self._calls)
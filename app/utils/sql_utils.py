@@ -1,33 +1,225 @@
 import sqlalchemy
+from datetime import date, datetime, time
 from decimal import Decimal
+import hashlib
 import logging
+import re
+
+from app.utils.columnar import ColumnarResult
 
 logger = logging.getLogger(__name__)
 
 
-def get_database_schema(engine):
+# Bulk catalog queries: every table's columns in one query and every primary/foreign key in another
+BULK_COLUMNS_QUERIES = {
+    "postgresql": """
+        SELECT c.table_name, c.column_name, c.data_type, c.is_nullable
+        FROM information_schema.columns c
+        JOIN information_schema.tables t
+          ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+        WHERE c.table_schema = current_schema() AND t.table_type = 'BASE TABLE'
+        ORDER BY c.table_name, c.ordinal_position
+    """,
+    "mysql": """
+        SELECT c.TABLE_NAME, c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE
+        FROM information_schema.COLUMNS c
+        JOIN information_schema.TABLES t
+          ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+        WHERE c.TABLE_SCHEMA = DATABASE() AND t.TABLE_TYPE = 'BASE TABLE'
+        ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+    """,
+}
+
+# Rows of (table, constraint, kind, column, referred_table, referred_column) ordered by key position.
+# kind is 'p' for primary keys and 'f' for foreign keys.
+BULK_KEYS_QUERIES = {
+    "postgresql": """
+        SELECT rel.relname, con.conname, con.contype, att.attname, frel.relname, fatt.attname
+        FROM pg_catalog.pg_constraint con
+        JOIN pg_catalog.pg_class rel ON rel.oid = con.conrelid
+        JOIN pg_catalog.pg_namespace nsp ON nsp.oid = rel.relnamespace
+        CROSS JOIN LATERAL unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_catalog.pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = k.attnum
+        LEFT JOIN pg_catalog.pg_class frel ON frel.oid = con.confrelid
+        LEFT JOIN pg_catalog.pg_attribute fatt
+          ON fatt.attrelid = con.confrelid AND fatt.attnum = con.confkey[k.ord]
+        WHERE nsp.nspname = current_schema() AND con.contype IN ('p', 'f')
+        ORDER BY rel.relname, con.conname, k.ord
+    """,
+    "mysql": """
+        SELECT TABLE_NAME, CONSTRAINT_NAME,
+               CASE WHEN CONSTRAINT_NAME = 'PRIMARY' THEN 'p' ELSE 'f' END,
+               COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+        FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND (CONSTRAINT_NAME = 'PRIMARY' OR REFERENCED_TABLE_NAME IS NOT NULL)
+        ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+    """,
+}
+
+
+def _empty_table():
+    return {"columns": [], "primary_key": [], "foreign_keys": []}
+
+
+def _reflect_schema_bulk(engine):
+    """
+    Reflect every table with two catalog queries instead of one round trip per table.
+    """
+    dialect = engine.dialect.name
+    schema = {}
+
+    with engine.connect() as connection:
+        for table_name, column_name, data_type, is_nullable in connection.execute(
+            sqlalchemy.text(BULK_COLUMNS_QUERIES[dialect])
+        ):
+            schema.setdefault(table_name, _empty_table())["columns"].append(
+                {"name": column_name, "type": str(data_type), "nullable": is_nullable == "YES"}
+            )
+
+        foreign_keys = {}
+        for table_name, constraint_name, kind, column_name, referred_table, referred_column in connection.execute(
+            sqlalchemy.text(BULK_KEYS_QUERIES[dialect])
+        ):
+            if table_name not in schema:
+                continue
+
+            if kind == "p":
+                schema[table_name]["primary_key"].append(column_name)
+                continue
+
+            foreign_key = foreign_keys.get((table_name, constraint_name))
+            if foreign_key is None:
+                foreign_key = {"columns": [], "referred_table": referred_table, "referred_columns": []}
+                foreign_keys[(table_name, constraint_name)] = foreign_key
+                schema[table_name]["foreign_keys"].append(foreign_key)
+
+            foreign_key["columns"].append(column_name)
+            foreign_key["referred_columns"].append(referred_column)
+
+    return schema
+
+
+def _reflect_schema_with_inspector(engine):
     """
-    Retrieve the schema (Tables and Column) of the connected database.
+    Reflect the schema table by table through the SQLAlchemy inspector.
     """
     inspector = sqlalchemy.inspect(engine)
     schema = {}
 
     for table_name in inspector.get_table_names():
-        columns = inspector.get_columns(table_name)
-        schema[table_name] = [col["name"] for col in columns]
+        table = _empty_table()
+
+        for col in inspector.get_columns(table_name):
+            table["columns"].append(
+                {"name": col["name"], "type": str(col["type"]), "nullable": bool(col.get("nullable", True))}
+            )
+
+        table["primary_key"] = list(inspector.get_pk_constraint(table_name).get("constrained_columns") or [])
+
+        for fk in inspector.get_foreign_keys(table_name):
+            table["foreign_keys"].append(
+                {
+                    "columns": list(fk["constrained_columns"]),
+                    "referred_table": fk["referred_table"],
+                    "referred_columns": list(fk["referred_columns"]),
+                }
+            )
+
+        schema[table_name] = table
 
     return schema
 
 
+def get_database_schema(engine):
+    """
+    Retrieve the schema of the connected database.
+
+    PostgreSQL and MySQL are reflected in bulk from the catalog; other dialects
+    fall back to the SQLAlchemy inspector.
+
+    Returns:
+        dict: Table name mapped to {"columns": [{"name", "type", "nullable"}],
+        "primary_key": [column names], "foreign_keys": [{"columns",
+        "referred_table", "referred_columns"}]}.
+    """
+    if engine.dialect.name in BULK_COLUMNS_QUERIES:
+        try:
+            return _reflect_schema_bulk(engine)
+        except Exception as e:
+            logger.warning(f"Bulk schema reflection failed, falling back to the inspector: {str(e)}")
+
+    return _reflect_schema_with_inspector(engine)
+
+
+def format_schema_description(schema):
+    """
+    Build the schema description given to the LLM: one line per table with its
+    column names and types, the primary key and the foreign key references.
+    """
+    lines = []
+    for table_name, table in schema.items():
+        primary_key = set(table["primary_key"])
+        columns = ", ".join(
+            f"{col['name']} ({col['type']}{', PK' if col['name'] in primary_key else ''})"
+            for col in table["columns"]
+        )
+        line = f"{table_name}: {columns}"
+
+        references = "; ".join(
+            f"{', '.join(fk['columns'])} -> {fk['referred_table']}.{', '.join(fk['referred_columns'])}"
+            for fk in table["foreign_keys"]
+        )
+        if references:
+            line += f" | references: {references}"
+
+        lines.append(line)
+
+    return "\n".join(lines)
+
+
+def build_column_index(schema):
+    """
+    Map lower-case table names to the set of their lower-case column names,
+    for case-insensitive lookups when validating generated SQL.
+    """
+    return {
+        table_name.lower(): {col["name"].lower() for col in table["columns"]}
+        for table_name, table in schema.items()
+    }
+
+
+# Quoted literals and identifiers are left untouched when canonicalizing SQL text
+SQL_QUOTED_PATTERN = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`)")
+
+
+def canonicalize_sql(query):
+    """
+    Canonical form of a SQL query for use as a cache key: whitespace outside quoted
+    literals collapsed to single spaces and any trailing semicolon removed.
+    """
+    parts = []
+    for part in SQL_QUOTED_PATTERN.split(query):
+        if SQL_QUOTED_PATTERN.fullmatch(part):
+            parts.append(part)
+        else:
+            parts.append(re.sub(r"\s+", " ", part))
+
+    return "".join(parts).strip().rstrip(";").strip()
+
+
 def convert_decimal_to_float(result):
     """
     Converts all Decimal values in the result to float.
     Args:
-        result (list): The SQL result as a list of dictionaries.
+        result (ColumnarResult | list): The SQL result, columnar or as a list of dictionaries.
 
     Returns:
-        list: The result with Decimal values converted to float.
+        The result with Decimal values converted to float.
     """
+    if isinstance(result, ColumnarResult):
+        return result.convert_decimals()
+
     for row in result:
         for key, value in row.items():
             if isinstance(value, Decimal):
@@ -35,6 +227,101 @@ def convert_decimal_to_float(result):
     return result
 
 
+def result_columns(result):
+    """
+    Column names of a SQL result, columnar or as a list of dictionaries.
+    """
+    if isinstance(result, ColumnarResult):
+        return list(dict.fromkeys(result.columns))
+    return list(result[0].keys()) if result else []
+
+
+def column_values(result, column):
+    """
+    All values of one column of a SQL result, columnar or as a list of dictionaries.
+    """
+    if isinstance(result, ColumnarResult):
+        return result.column_values(column)
+    return [row.get(column) for row in result]
+
+
+def column_kind(values):
+    """
+    Classify the non-null values of a result column as numeric, boolean, temporal or text.
+    """
+    if not values:
+        return "empty"
+    if all(isinstance(v, bool) for v in values):
+        return "boolean"
+    if all(isinstance(v, (int, float, Decimal)) and not isinstance(v, bool) for v in values):
+        return "numeric"
+    if all(isinstance(v, (date, datetime, time)) for v in values):
+        return "temporal"
+    return "text"
+
+
+def profile_columns(result):
+    """
+    Describe every column of a SQL result.
+    Args:
+        result (ColumnarResult | list): The SQL result, columnar or as a list of dictionaries.
+
+    Returns:
+        list: One dictionary per column with its name, kind, distinct count and null count.
+    """
+    if not result:
+        return []
+
+    profiles = []
+    for column in result_columns(result):
+        values = column_values(result, column)
+        non_null = [v for v in values if v is not None]
+        profiles.append(
+            {
+                "name": column,
+                "kind": column_kind(non_null),
+                "distinct": len(set(map(str, non_null))),
+                "nulls": len(values) - len(non_null),
+            }
+        )
+    return profiles
+
+
+def column_signature(result):
+    """
+    Column names and kinds of a SQL result, e.g. (("customer_name", "text"), ("total", "numeric")).
+    Results with the same signature can be drawn by the same plot code.
+    """
+    if not result:
+        return ()
+
+    return tuple(
+        (column, column_kind([value for value in column_values(result, column) if value is not None]))
+        for column in result_columns(result)
+    )
+
+
+def result_fingerprint(result):
+    """
+    Content hash of a SQL result's column names and values, equal for results holding the same data.
+    """
+    digest = hashlib.sha256()
+
+    if isinstance(result, ColumnarResult):
+        for column, array in zip(result.columns, result.arrays):
+            digest.update(repr(column).encode("utf-8"))
+            # Numeric columns hash their raw buffer, object columns their values' representation
+            if array.dtype == object:
+                digest.update(repr(array.tolist()).encode("utf-8"))
+            else:
+                digest.update(array.dtype.str.encode("ascii"))
+                digest.update(array.tobytes())
+    else:
+        digest.update(repr(result).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
 def create_readonly_user(engine, database_name):
     try:
         readonly_username = "llm_readonly_user"
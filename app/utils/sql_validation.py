@@ -0,0 +1,163 @@
+import difflib
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+from sqlglot.optimizer.scope import traverse_scope
+
+# SQLAlchemy dialect names mapped to sqlglot dialects
+SQLGLOT_DIALECTS = {
+    "postgresql": "postgres",
+    "mysql": "mysql",
+    "sqlite": "sqlite",
+}
+
+# Statement types that must never be sent to the database
+DISALLOWED_STATEMENTS = tuple(
+    getattr(exp, name)
+    for name in ("Insert", "Update", "Delete", "Merge", "Drop", "Create", "Alter", "TruncateTable", "Grant", "Command")
+    if hasattr(exp, name)
+)
+
+ALLOWED_ROOTS = (exp.Select, exp.Union, exp.Intersect, exp.Except)
+
+
+def parse_sql(query, dialect_name=None):
+    """
+    Parse a single SQL statement with the dialect of the connected database.
+
+    Raises:
+        ValueError: With the parser's message and position when the query does not parse,
+        or when it holds more or fewer than one statement.
+    """
+    try:
+        statements = [s for s in sqlglot.parse(query, read=SQLGLOT_DIALECTS.get(dialect_name)) if s is not None]
+    except ParseError as e:
+        details = e.errors[0] if e.errors else {}
+        position = f" at line {details.get('line')}, column {details.get('col')}" if details.get("line") else ""
+        message = details.get("description") or str(e)
+        raise ValueError(f"SQL syntax error{position}: {message}")
+
+    if len(statements) != 1:
+        raise ValueError(f"Expected exactly one SQL statement, found {len(statements)}.")
+
+    return statements[0]
+
+
+def find_disallowed_statement(tree):
+    """
+    Return the type of the first non-SELECT statement found in the parsed query
+    (e.g. 'DROP'), or None when the query only reads data.
+    """
+    node = tree.find(*DISALLOWED_STATEMENTS)
+    if node is not None:
+        return node.key.upper()
+
+    if not isinstance(tree, ALLOWED_ROOTS):
+        return tree.key.upper()
+
+    return None
+
+
+def _suggestion(name, candidates):
+    matches = difflib.get_close_matches(name, candidates, n=1)
+    return f" Did you mean '{matches[0]}'?" if matches else ""
+
+
+def _scope_sources(scope, column_index):
+    """
+    Map every table alias visible in a scope, including those of enclosing scopes for
+    correlated subqueries, to the set of its column names, or to None when the columns
+    are unknown (subqueries, CTEs, tables outside the reflected schema).
+    """
+    sources = {}
+    while scope is not None:
+        for alias, source in scope.sources.items():
+            if alias.lower() in sources:
+                continue
+
+            if isinstance(source, exp.Table) and not source.db:
+                sources[alias.lower()] = column_index.get(source.name.lower())
+            else:
+                sources[alias.lower()] = None
+        scope = scope.parent
+    return sources
+
+
+def validate_references(tree, column_index):
+    """
+    Check the tables and columns referenced by a parsed query against the schema.
+
+    Args:
+        tree: The parsed query from parse_sql.
+        column_index (dict): Lower-case table names mapped to sets of lower-case column names.
+
+    Returns:
+        str: A description of the first problems found, or None when the query is valid.
+    """
+    errors = []
+
+    cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    for table in tree.find_all(exp.Table):
+        if not isinstance(table.this, exp.Identifier) or table.db:
+            continue
+
+        name = table.name.lower()
+        if name not in column_index and name not in cte_names:
+            errors.append(f"Table '{table.name}' does not exist.{_suggestion(name, list(column_index))}")
+
+    for scope in traverse_scope(tree):
+        if not isinstance(scope.expression, exp.Select):
+            continue
+
+        local_sources = {alias.lower() for alias in scope.sources}
+        sources = _scope_sources(scope, column_index)
+        select_aliases = {select.alias.lower() for select in scope.expression.selects if select.alias}
+
+        for column in scope.columns:
+            # sqlglot also lists unresolved columns of correlated subqueries in the outer
+            # scope, check each column only in the SELECT it is written in
+            if isinstance(column.this, exp.Star) or column.find_ancestor(exp.Select) is not scope.expression:
+                continue
+
+            name = column.name.lower()
+            qualifier = column.table.lower()
+
+            if qualifier:
+                if qualifier not in sources:
+                    errors.append(f"Unknown table or alias '{column.table}' in '{column.sql()}'.")
+                    continue
+
+                columns = sources[qualifier]
+                if columns is not None and name not in columns:
+                    errors.append(
+                        f"Column '{column.name}' does not exist in '{column.table}'.{_suggestion(name, list(columns))}"
+                    )
+                continue
+
+            if name in select_aliases:
+                continue
+
+            # Unqualified columns resolve against this scope's own tables first
+            local = {alias: sources[alias] for alias in local_sources}
+            if any(columns is None for columns in local.values()):
+                continue
+
+            matches = sorted(alias for alias, columns in local.items() if name in columns)
+            if len(matches) > 1:
+                errors.append(
+                    f"Column '{column.name}' is ambiguous, it exists in {', '.join(matches)}. "
+                    f"Qualify it with the table name or alias."
+                )
+            elif not matches and not any(columns is None or name in columns for columns in sources.values()):
+                known = sorted({c for columns in local.values() for c in columns})
+                errors.append(
+                    f"Column '{column.name}' does not exist in {', '.join(sorted(local)) or 'the query'}."
+                    f"{_suggestion(name, known)}"
+                )
+
+    if not errors:
+        return None
+
+    # Keep the retry prompt short
+    return " ".join(dict.fromkeys(errors[:5]))
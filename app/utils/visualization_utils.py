@@ -1,21 +1,156 @@
 import logging
-from langchain_groq import ChatGroq
+import os
+import re
+from app.services.llm_gateway import get_llm, llm_gateway
+from app.utils.metrics import llm_config, timed
+from app.utils.prompt_encoding import encode_result_for_prompt
+from app.utils.sql_utils import column_values, profile_columns
 
 # Initialize logger for debugging purposes
 logger = logging.getLogger(__name__)
 
 # Initialize Groq LLM
-# Initialize Groq LLM
-groq_llm = ChatGroq(
-    model="llama3-8b-8192",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=10,
-)
+groq_llm = get_llm("llama3-8b-8192", temperature=0)
+
+
+# Up to this confidence the heuristic classifier defers to the LLM, only a higher one is trusted
+CHART_CONFIDENCE_THRESHOLD = float(os.getenv("CHART_CONFIDENCE_THRESHOLD", "0.6"))
+
+EXPLICIT_CHART_PATTERNS = {
+    "pie": re.compile(r"\bpie\b", re.IGNORECASE),
+    # A bare "line" is usually data, as in "sales per product line"
+    "line": re.compile(r"\bline[\s-]*(chart|graph|plot)s?\b", re.IGNORECASE),
+    "scatter": re.compile(r"\bscatter\b", re.IGNORECASE),
+    "heatmap": re.compile(r"\bheat ?map\b", re.IGNORECASE),
+    "histogram": re.compile(r"\bhistogram\b", re.IGNORECASE),
+    "bar": re.compile(r"\bbar\b", re.IGNORECASE),
+}
+
+SHARE_KEYWORDS = re.compile(r"\b(share|percentage|percent|proportion|breakdown|composition)\b", re.IGNORECASE)
+TREND_KEYWORDS = re.compile(r"\b(trend|over time|monthly|weekly|daily|yearly|per (day|week|month|quarter|year)|by (day|week|month|quarter|year))\b", re.IGNORECASE)
+RELATION_KEYWORDS = re.compile(r"\b(vs|versus|correlat\w*|relationship|against)\b", re.IGNORECASE)
+DISTRIBUTION_KEYWORDS = re.compile(r"\bdistribution\b", re.IGNORECASE)
+
+TIME_COLUMN_NAME = re.compile(r"(^|_)(date|day|week|month|year|quarter|time|period)(_|s?$)", re.IGNORECASE)
+TIME_VALUE = re.compile(r"^\d{4}(-\d{2}){0,2}([ T].*)?$")
+
+# Numeric keys such as id or customer_id label rows, they are categories and never measures
+IDENTIFIER_COLUMN_NAME = re.compile(r"(^|_)(id|key|pk|fk)$", re.IGNORECASE)
+
+# Whole numbers in this range are read as years when the result has another numeric column to draw
+YEAR_RANGE = (1900, 2100)
+
+
+def time_like_columns(result, profiles):
+    """
+    Names of the columns holding dates or times: temporal values, a time-like column
+    name (order_date, month) or text values such as '2024-01'.
+    """
+    numeric_count = sum(profile["kind"] == "numeric" for profile in profiles)
+
+    names = []
+    for profile in profiles:
+        if profile["kind"] == "temporal":
+            names.append(profile["name"])
+        elif profile["kind"] in ("text", "numeric") and TIME_COLUMN_NAME.search(profile["name"]):
+            names.append(profile["name"])
+        elif profile["kind"] == "text":
+            values = [v for v in column_values(result[:20], profile["name"]) if v is not None]
+            if values and all(TIME_VALUE.match(str(v)) for v in values):
+                names.append(profile["name"])
+        elif profile["kind"] == "numeric" and numeric_count > 1 and not IDENTIFIER_COLUMN_NAME.search(profile["name"]):
+            values = [v for v in column_values(result, profile["name"]) if v is not None]
+            if values and all(float(v).is_integer() and YEAR_RANGE[0] <= v <= YEAR_RANGE[1] for v in values):
+                names.append(profile["name"])
+    return names
+
+
+def chart_columns(result, profiles):
+    """
+    Split a result's columns into time-like column names, measures and categories.
+    Numeric identifiers (id, customer_id) count as categories rather than measures,
+    and are left out entirely when the result also has a label column to draw.
+
+    Returns:
+        tuple: The time-like column names, and the profiles of the measures and of the categories.
+    """
+    time_columns = time_like_columns(result, profiles)
+    measures, categories = [], []
+    for profile in profiles:
+        if profile["name"] in time_columns:
+            continue
+        if profile["kind"] == "numeric" and not IDENTIFIER_COLUMN_NAME.search(profile["name"]):
+            measures.append(profile)
+        elif profile["kind"] in ("text", "boolean", "numeric"):
+            categories.append(profile)
+
+    # (customer_id, customer_name, total) is one category, not a heatmap of ID by name
+    labels = [profile for profile in categories if not IDENTIFIER_COLUMN_NAME.search(profile["name"])]
+    if labels:
+        categories = labels
+    return time_columns, measures, categories
+
+
+def classify_chart_type(sql_result, question):
+    """
+    Pick a chart type locally from the result's column kinds, row count, distinct counts,
+    time-like columns and keywords in the question.
+    Args:
+        sql_result (list): The SQL query result in list format.
+        question (str): The user's natural language query.
+
+    Returns:
+        tuple: The chart type (e.g. 'bar', 'line', 'pie') and a confidence between 0 and 1.
+    """
+    for chart_type, pattern in EXPLICIT_CHART_PATTERNS.items():
+        if pattern.search(question):
+            return chart_type, 0.95
+
+    if not sql_result:
+        return "bar", 0.0
+
+    time_columns, numeric, categories = chart_columns(sql_result, profile_columns(sql_result))
+
+    if time_columns and numeric:
+        return "line", 0.9 if TREND_KEYWORDS.search(question) else 0.8
+
+    if len(categories) == 1 and numeric:
+        distinct = categories[0]["distinct"]
+        if SHARE_KEYWORDS.search(question) and len(numeric) == 1 and distinct <= 8:
+            return "pie", 0.85
+        if len(sql_result) == 1:
+            return "bar", 0.5
+        return "bar", 0.8 if distinct <= 50 else 0.5
+
+    if len(categories) == 2 and len(numeric) == 1:
+        return "heatmap", 0.7 if all(p["distinct"] <= 30 for p in categories) else 0.4
+
+    if not categories and len(numeric) >= 2:
+        return "scatter", 0.9 if RELATION_KEYWORDS.search(question) else 0.7
+
+    if not categories and len(numeric) == 1 and len(sql_result) > 1:
+        return "histogram", 0.85 if DISTRIBUTION_KEYWORDS.search(question) else 0.6
+
+    return "bar", 0.3
+
+
+async def detect_chart_type(sql_result, question):
+    """
+    Detect the chart type with the local classifier, asking the LLM only when the
+    classifier's confidence does not exceed CHART_CONFIDENCE_THRESHOLD.
+    """
+    chart_type, confidence = classify_chart_type(sql_result, question)
+    logger.info(f"Heuristic chart type: {chart_type} (confidence {confidence:.2f})")
+
+    if confidence > CHART_CONFIDENCE_THRESHOLD:
+        return chart_type
+
+    llm_chart_type = await detect_chart_type_with_llm(sql_result, question)
+    return llm_chart_type or chart_type
 
 
-def detect_chart_type_with_llm(sql_result, question):
+@timed("detect_chart_type_with_llm")
+async def detect_chart_type_with_llm(sql_result, question):
     """
     Uses the Groq LLM model to detect and return the appropriate chart type based on the SQL result.
     Args:
@@ -26,7 +161,7 @@ def detect_chart_type_with_llm(sql_result, question):
         str: The chart type (e.g., 'bar', 'line', 'pie', etc.), with no additional text or comments.
     """
 
-    formatted_sql_result = str(sql_result)
+    formatted_sql_result = encode_result_for_prompt(sql_result)
 
     # Prompt to the LLM to detect the chart type
     prompt = f"""
@@ -42,7 +177,7 @@ def detect_chart_type_with_llm(sql_result, question):
         logger.info(f"Invoking Groq LLM to detect chart type for visualization.")
 
         # Invoke the LLM with the prompt
-        ai_response = groq_llm.invoke(prompt)
+        ai_response = await llm_gateway.ainvoke(groq_llm, prompt, config=llm_config("chart_type"))
 
         # Checking if the AI response is valid
         if not ai_response or not ai_response.content:
@@ -0,0 +1,390 @@
+"""
+Offline per-stage benchmarks of the question -> SQL -> chart pipeline.
+
+The Groq LLM is replaced by a fake chat model with canned responses and the data comes
+from a synthetic sales database (SQLite by default, or any database given with
+--database-url), so the numbers only reflect the application's own work.
+
+Usage:
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --scales 1000,100000 --output results.json
+    python -m benchmarks.run_benchmarks --baseline baseline.json --threshold 0.2
+
+With --baseline the run exits with status 1 when the median time of any stage is
+more than `threshold` (a fraction) slower than in the baseline results.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+
+# The LLM clients are created at import time and need an API key, even a fake one
+os.environ.setdefault("GROQ_API_KEY", "offline-benchmark")
+# Measure the query path itself, not the optional result cache
+os.environ["RESULT_CACHE_ENABLED"] = "false"
+# Let the scan stage read the whole fixture unless a row limit is asked for
+os.environ.setdefault("QUERY_MAX_ROWS", "0")
+# The fake LLM has no provider rate limits to respect
+os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "0")
+os.environ.setdefault("LLM_TOKENS_PER_MINUTE", "0")
+os.environ.setdefault("LLM_CACHE_MODE", "off")
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from sqlalchemy import (
+    Column,
+    Date,
+    ForeignKey,
+    Integer,
+    MetaData,
+    Numeric,
+    String,
+    Table,
+    create_engine,
+    insert,
+)
+
+import app.services.query_chain as query_chain
+import app.utils.visualization_utils as visualization_utils
+from app.db.schema_cache import invalidate_schema, refresh_schema
+from app.services.chart_templates import render_chart_template
+from app.services.query_service import execute_sql
+from app.services.render_pool import render_pool
+from app.services.visualization_service import execute_plot_code
+from app.utils.clean_ai_plot_code import clean_ai_plot_code
+from app.utils.columnar import ColumnarResult
+from app.utils.prompt_encoding import encode_result_for_prompt
+from app.utils.sql_utils import convert_decimal_to_float, format_schema_description, get_database_schema
+from app.utils.visualization_utils import classify_chart_type
+
+DEFAULT_SCALES = (1000, 10000, 100000)
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.2
+
+# Slowdowns smaller than this are timer noise, not regressions
+MIN_REGRESSION_MS = 1.0
+
+# Unrelated tables added to the fixture so schema handling works on a realistic catalog
+EXTRA_TABLES = 30
+
+QUESTION = "What are the total sales per product?"
+
+AGGREGATE_SQL = """
+SELECT p.product_name, SUM(s.quantity * s.unit_price) AS total_sales
+FROM sales s
+JOIN products p ON p.product_id = s.product_id
+GROUP BY p.product_name
+ORDER BY total_sales DESC
+"""
+
+SCAN_SQL = "SELECT s.sale_id, s.sale_date, s.quantity, s.unit_price, c.city FROM sales s JOIN customers c ON c.customer_id = s.customer_id"
+
+# The SQL chain returns the bare query, extract_sql_from_response handles chattier answers
+LLM_SQL_RESPONSE = AGGREGATE_SQL.strip()
+LLM_SQL_ANSWER = f"Here is the SQL query to answer the question:\n\n```sql\n{AGGREGATE_SQL.strip()};\n```"
+
+LLM_PLOT_RESPONSE = """Here is the Python code to create a bar chart:
+```python
+import pandas as pd
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+df = pd.DataFrame(result)
+df['total_sales'] = df['total_sales'].astype(float)
+sns.set_style("darkgrid")
+plt.figure(figsize=(14, 10))
+ax = sns.barplot(data=df, x='product_name', y='total_sales')
+ax.bar_label(ax.containers[0], fmt='%.1f')
+plt.title('Total sales per product')
+plt.xticks(rotation=45)
+plt.show()
+```
+This code will create a bar chart of the total sales per product."""
+
+
+def create_fixture(engine, rows, seed=42):
+    """
+    Create the synthetic sales schema and fill it with `rows` sales rows.
+    """
+    metadata = MetaData()
+    customers = Table(
+        "customers",
+        metadata,
+        Column("customer_id", Integer, primary_key=True),
+        Column("customer_name", String(100)),
+        Column("city", String(100)),
+    )
+    products = Table(
+        "products",
+        metadata,
+        Column("product_id", Integer, primary_key=True),
+        Column("product_name", String(100)),
+        Column("category", String(50)),
+        Column("price", Numeric(10, 2)),
+    )
+    sales = Table(
+        "sales",
+        metadata,
+        Column("sale_id", Integer, primary_key=True),
+        Column("customer_id", Integer, ForeignKey("customers.customer_id")),
+        Column("product_id", Integer, ForeignKey("products.product_id")),
+        Column("sale_date", Date),
+        Column("quantity", Integer),
+        Column("unit_price", Numeric(10, 2)),
+    )
+    for i in range(EXTRA_TABLES):
+        Table(
+            f"audit_table_{i}",
+            metadata,
+            Column("id", Integer, primary_key=True),
+            Column("event_name", String(50)),
+            Column("created_on", Date),
+        )
+
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+    generator = random.Random(seed)
+    cities = ["Phnom Penh", "Siem Reap", "Battambang", "Kampot", "Kep"]
+    categories = ["Hardware", "Software", "Services"]
+    start = date(2023, 1, 1)
+
+    with engine.begin() as connection:
+        connection.execute(
+            insert(customers),
+            [{"customer_id": i, "customer_name": f"Customer {i}", "city": generator.choice(cities)} for i in range(500)],
+        )
+        connection.execute(
+            insert(products),
+            [
+                {
+                    "product_id": i,
+                    "product_name": f"Product {i}",
+                    "category": generator.choice(categories),
+                    "price": Decimal(generator.randint(100, 10000)) / 100,
+                }
+                for i in range(20)
+            ],
+        )
+
+        batch = []
+        for i in range(rows):
+            batch.append(
+                {
+                    "sale_id": i,
+                    "customer_id": generator.randrange(500),
+                    "product_id": generator.randrange(20),
+                    "sale_date": start + timedelta(days=generator.randrange(730)),
+                    "quantity": generator.randint(1, 20),
+                    "unit_price": Decimal(generator.randint(100, 10000)) / 100,
+                }
+            )
+            if len(batch) == 10000:
+                connection.execute(insert(sales), batch)
+                batch = []
+        if batch:
+            connection.execute(insert(sales), batch)
+
+
+def with_decimals(result):
+    """
+    Return a copy of a result with its float columns as Decimal, as PostgreSQL's NUMERIC
+    columns arrive (SQLite returns floats).
+    """
+    rows = result.to_rows() if isinstance(result, ColumnarResult) else [dict(row) for row in result]
+    for row in rows:
+        for key, value in row.items():
+            if isinstance(value, float):
+                row[key] = Decimal(str(value))
+    return ColumnarResult.from_rows(rows)
+
+
+def measure(function, repeat, setup=None):
+    """
+    Time `function` `repeat` times, then run it once more under tracemalloc for its peak memory.
+    `setup` prepares a fresh argument for every run, outside the timed section.
+    """
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        started = time.perf_counter()
+        function(argument) if setup else function()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    argument = setup() if setup else None
+    tracemalloc.start()
+    try:
+        function(argument) if setup else function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "max_ms": round(max(timings), 3),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def run_async(coroutine_function):
+    return lambda *args: asyncio.run(coroutine_function(*args))
+
+
+def benchmark_scale(engine, rows, repeat, include_render):
+    """
+    Run every stage against a fixture of `rows` sales rows and return the results per stage.
+    """
+    create_fixture(engine, rows)
+    invalidate_schema(engine)
+
+    schema = get_database_schema(engine)
+    schema_entry = refresh_schema(engine)
+    aggregate = execute_sql(engine, AGGREGATE_SQL)
+    scan = execute_sql(engine, SCAN_SQL)
+
+    async def generate_sql():
+        query_chain.sql_cache.clear()
+        query_chain.groq_llm = query_chain.uncached_groq_llm = FakeListChatModel(responses=[LLM_SQL_RESPONSE])
+        return await query_chain.generate_sql_and_execute(QUESTION, engine)
+
+    async def generate_plot_code():
+        query_chain.plot_code_cache.clear()
+        query_chain.groq_llm = query_chain.uncached_groq_llm = FakeListChatModel(responses=[LLM_PLOT_RESPONSE])
+        return await query_chain.generate_plot_code_from_ai(aggregate, QUESTION)
+
+    plot_code = asyncio.run(generate_plot_code()).code
+
+    stages = {
+        "schema_reflection": measure(lambda: refresh_schema(engine), repeat),
+        "schema_description": measure(lambda: format_schema_description(schema), repeat),
+        "schema_pruning": measure(lambda: schema_entry.schema_index.relevant_tables(QUESTION), repeat),
+        "extract_sql_from_response": measure(
+            lambda: query_chain.extract_sql_from_response(LLM_SQL_ANSWER), repeat
+        ),
+        "generate_sql_and_execute": measure(run_async(generate_sql), repeat),
+        "execute_sql_aggregate": measure(lambda: execute_sql(engine, AGGREGATE_SQL), repeat),
+        "execute_sql_scan": measure(lambda: execute_sql(engine, SCAN_SQL), repeat),
+        "convert_decimal_to_float": measure(convert_decimal_to_float, repeat, setup=lambda: with_decimals(scan)),
+        "encode_result_for_prompt": measure(lambda: encode_result_for_prompt(scan), repeat),
+        "classify_chart_type": measure(lambda: classify_chart_type(aggregate, QUESTION), repeat),
+        "generate_plot_code_from_ai": measure(run_async(generate_plot_code), repeat),
+        "clean_ai_plot_code": measure(lambda: clean_ai_plot_code(LLM_PLOT_RESPONSE), repeat),
+        "render_chart_template": measure(lambda: render_chart_template(aggregate, QUESTION), repeat),
+    }
+
+    if include_render:
+        stages["execute_plot_code"] = measure(run_async(lambda: execute_plot_code(plot_code, aggregate)), repeat)
+
+    return {"rows": rows, "scan_rows": len(scan), "stages": stages}
+
+
+def compare(results, baseline, threshold):
+    """
+    Return the stages whose median time regressed by more than `threshold` against the baseline.
+    """
+    regressions = []
+    baseline_scales = {str(scale["rows"]): scale for scale in baseline.get("scales", [])}
+
+    for scale in results["scales"]:
+        previous = baseline_scales.get(str(scale["rows"]))
+        if previous is None:
+            continue
+
+        for stage, current in scale["stages"].items():
+            before = previous["stages"].get(stage)
+            if not before or not before["median_ms"]:
+                continue
+
+            change = current["median_ms"] / before["median_ms"] - 1
+            if change > threshold and current["median_ms"] - before["median_ms"] > MIN_REGRESSION_MS:
+                regressions.append(
+                    f"{stage} at {scale['rows']} rows: {before['median_ms']:.3f} ms -> "
+                    f"{current['median_ms']:.3f} ms (+{change:.0%})"
+                )
+
+    return regressions
+
+
+def print_report(results):
+    for scale in results["scales"]:
+        print(f"\n{scale['rows']} sales rows ({scale['scan_rows']} rows scanned)")
+        print(f"{'stage':<28} {'median ms':>11} {'min ms':>10} {'max ms':>10} {'peak KB':>11}")
+        for stage, timing in scale["stages"].items():
+            print(
+                f"{stage:<28} {timing['median_ms']:>11.3f} {timing['min_ms']:>10.3f} "
+                f"{timing['max_ms']:>10.3f} {timing['peak_kb']:>11.1f}"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline per-stage benchmarks of the NLP-to-SQL pipeline.")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)), help="Comma-separated sales row counts.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed runs per stage.")
+    parser.add_argument("--database-url", help="Database to build the fixture in (default: a temporary SQLite file).")
+    parser.add_argument("--skip-render", action="store_true", help="Skip the render worker pool stage.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed slowdown per stage, e.g. 0.2 for 20%%.")
+    args = parser.parse_args(argv)
+
+    # The pipeline logs every prompt and result at INFO level
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(args.database_url or f"sqlite:///{os.path.join(directory, 'benchmark.db')}")
+
+        # Chart type detection asks the LLM only when its heuristics are unsure
+        visualization_utils.groq_llm = FakeListChatModel(responses=["bar"])
+
+        if not args.skip_render:
+            render_pool.start()
+
+        try:
+            results = {
+                "database": engine.dialect.name,
+                "python": sys.version.split()[0],
+                "repeat": args.repeat,
+                "scales": [
+                    benchmark_scale(engine, int(rows), args.repeat, not args.skip_render)
+                    for rows in args.scales.split(",")
+                ],
+            }
+        finally:
+            render_pool.shutdown()
+            engine.dispose()
+
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nStages more than {args.threshold:.0%} slower than the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+
+        print(f"\nNo stage is more than {args.threshold:.0%} slower than the baseline.")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+from app.utils import cache as cache_module
+from app.utils.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    cache = TTLCache(ttl=10)
+
+    cache.set("a", 1)
+    clock.now += 9.9
+    assert cache.get("a") == 1
+
+    clock.now += 0.1
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.stats()["misses"] == 1
+
+
+def test_setting_again_restarts_the_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    cache = TTLCache(ttl=10)
+
+    cache.set("a", 1)
+    clock.now += 8
+    cache.set("a", 2)
+    clock.now += 8
+    assert cache.get("a") == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_budget_evicts_oldest_entries():
+    cache = TTLCache(max_bytes=10, sizeof=len)
+    cache.set("a", b"xxxx")
+    cache.set("b", b"xxxx")
+    cache.set("c", b"xxxx")
+
+    assert cache.get("a") is None
+    assert cache.get("b") == b"xxxx"
+    assert cache.get("c") == b"xxxx"
+    assert cache.stats()["bytes"] == 8
+
+
+def test_value_larger_than_budget_is_not_cached():
+    cache = TTLCache(max_bytes=10, sizeof=len)
+    cache.set("a", b"xxxx")
+    cache.set("big", b"x" * 11)
+
+    assert cache.get("big") is None
+    assert cache.get("a") == b"xxxx"
+
+
+def test_replacing_a_value_updates_the_byte_count():
+    cache = TTLCache(max_bytes=10, sizeof=len)
+    cache.set("a", b"xxxxxx")
+    cache.set("a", b"xx")
+    assert cache.stats()["bytes"] == 2
+
+    assert cache.pop("a") == b"xx"
+    assert cache.stats()["bytes"] == 0
+
@@ -0,0 +1,43 @@
+from app.services.chart_templates import pick_template
+
+CUSTOMERS = [
+    {"customer_id": 1, "customer_name": "Ann", "total_sales": 120.5},
+    {"customer_id": 2, "customer_name": "Bob", "total_sales": 80.0},
+    {"customer_id": 3, "customer_name": "Cid", "total_sales": 42.0},
+]
+
+PRODUCTS = [
+    {"product_id": 10, "product_name": "Desk", "total": 7},
+    {"product_id": 11, "product_name": "Lamp", "total": 3},
+]
+
+
+def test_identifier_label_and_measure_render_as_a_bar_by_label():
+    assert pick_template(CUSTOMERS, "Total sales per customer") == {
+        "chart_type": "bar",
+        "x": "customer_name",
+        "y": ["total_sales"],
+    }
+    assert pick_template(PRODUCTS, "Units sold per product") == {
+        "chart_type": "bar",
+        "x": "product_name",
+        "y": ["total"],
+    }
+
+
+def test_heat_map_and_color_wording_keep_the_template_path():
+    sales = [
+        {"region": "North", "product": "Desk", "sales": 3},
+        {"region": "South", "product": "Lamp", "sales": 4},
+    ]
+    colors = [{"color": "Red", "total": 5}, {"color": "Blue", "total": 9}]
+
+    assert pick_template(sales, "Show a heat map of sales by region and product")["chart_type"] == "heatmap"
+    assert pick_template(colors, "Total sales by color") == {"chart_type": "bar", "x": "color", "y": ["total"]}
+
+
+def test_filters_and_other_chart_families_go_to_the_llm():
+    assert pick_template(CUSTOMERS, "Total sales per customer excluding Bob") is None
+    assert pick_template(CUSTOMERS, "Total sales per customer except Ann") is None
+    assert pick_template(CUSTOMERS, "Area chart of total sales per customer") is None
+    assert pick_template(CUSTOMERS, "Total sales per customer on a choropleth") is None
@@ -0,0 +1,60 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.query_governor import _plan_estimates, apply_row_limit
+
+# EXPLAIN FORMAT=JSON of a two-table join, as MySQL 8 returns it
+MYSQL_JOIN_PLAN = {
+    "query_block": {
+        "select_id": 1,
+        "cost_info": {"query_cost": "5120.40"},
+        "ordering_operation": {
+            "using_filesort": True,
+            "nested_loop": [
+                {"table": {"table_name": "customers", "rows_examined_per_scan": 500, "rows_produced_per_join": 500}},
+                {"table": {"table_name": "orders", "rows_examined_per_scan": 40, "rows_produced_per_join": 20000}},
+            ],
+        },
+    }
+}
+
+
+def test_limit_is_appended_to_a_query_without_one():
+    assert apply_row_limit("SELECT * FROM sales;", "sqlite", 100) == "SELECT * FROM sales LIMIT 100"
+
+
+def test_smaller_limit_is_kept():
+    query = "SELECT * FROM sales LIMIT 10"
+    assert apply_row_limit(query, "sqlite", 100) == query
+
+
+def test_larger_limit_is_lowered():
+    assert apply_row_limit("SELECT * FROM sales LIMIT 5000", "postgresql", 100) == "SELECT * FROM sales LIMIT 100"
+
+
+def test_query_ending_in_a_line_comment_is_rewritten():
+    # Appended after the comment the LIMIT would be commented out
+    assert apply_row_limit("SELECT * FROM sales -- all rows", "sqlite", 100) == "SELECT * FROM sales /* all rows */ LIMIT 100"
+
+
+def test_disabled_limit_returns_the_query_unchanged():
+    query = "SELECT * FROM sales"
+    assert apply_row_limit(query, "sqlite", 0) == query
+
+
+def test_unparsable_query_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        apply_row_limit("SELECT FROM WHERE (", "sqlite", 100)
+    assert error.value.status_code == 400
+
+
+def test_mysql_plan_rows_are_read_from_nested_joins():
+    connection = SimpleNamespace(
+        dialect=SimpleNamespace(name="mysql"),
+        execute=lambda statement: SimpleNamespace(scalar=lambda: json.dumps(MYSQL_JOIN_PLAN)),
+    )
+
+    assert _plan_estimates(connection, "SELECT 1") == (5120.4, 20000.0)
@@ -0,0 +1,22 @@
+from app.utils.question_utils import normalize_question
+
+
+def test_case_whitespace_and_closing_punctuation_are_normalized():
+    assert normalize_question("  Total   Sales per Product?? ") == "total sales per product"
+
+
+def test_comparison_operators_are_kept():
+    assert normalize_question("sales > 100") != normalize_question("sales < 100")
+    assert normalize_question("amount >= 10") == "amount >= 10"
+    assert normalize_question("status != 'open'") == "status != 'open'"
+
+
+def test_signs_and_decimal_points_are_kept():
+    assert normalize_question("profit below -5") != normalize_question("profit below 5")
+    assert normalize_question("rating above 4.5") == "rating above 4.5"
+    assert normalize_question("growth over 10%") == "growth over 10%"
+
+
+def test_quoted_literals_are_kept_verbatim():
+    assert normalize_question("Sales of 'Product XX'") == "sales of 'Product XX'"
+    assert normalize_question('Orders from "New  York"') == 'orders from "New  York"'
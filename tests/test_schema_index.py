@@ -0,0 +1,42 @@
+from app.utils.schema_index import SchemaIndex, tokenize
+
+
+def table(*columns, references=()):
+    return {
+        "columns": [{"name": column} for column in columns],
+        "foreign_keys": [{"referred_table": referred} for referred in references],
+    }
+
+
+SCHEMA = {
+    "users": table("id", "email", "full_name"),
+    "orders": table("id", "user_id", "total", "ordered_at", references=["users"]),
+    "order_items": table("id", "order_id", "product_id", "quantity", references=["orders", "products"]),
+    "products": table("id", "product_name", "price"),
+    "audit_log": table("id", "user_id", "action", references=["users"]),
+    "invoices": table("id", "order_id", "amount", references=["orders"]),
+}
+
+
+def test_tokenize_splits_and_stems_identifiers():
+    assert tokenize("orderItems") == ["order", "item"]
+    assert tokenize("customer_categories") == ["customer", "category"]
+    assert tokenize("address") == ["address"]
+
+
+def test_best_matching_table_ranks_first():
+    assert SchemaIndex(SCHEMA).relevant_tables("product prices", top_k=1)[0] == "products"
+
+
+def test_referenced_tables_are_added():
+    tables = SchemaIndex(SCHEMA).relevant_tables("order item quantities", top_k=1)
+    assert tables == ["order_items", "orders", "products"]
+
+
+def test_referencing_tables_are_not_added():
+    tables = SchemaIndex(SCHEMA).relevant_tables("user emails", top_k=1)
+    assert tables == ["users"]
+
+
+def test_no_match_returns_no_tables():
+    assert SchemaIndex(SCHEMA).relevant_tables("weather forecast") == []
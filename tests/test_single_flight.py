@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from app.utils.single_flight import SingleFlight
+
+
+def test_concurrent_calls_with_the_same_key_share_one_run():
+    flights = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "rows"
+
+    async def main():
+        return await asyncio.gather(*(flights.do("key", work) for _ in range(5)))
+
+    results = asyncio.run(main())
+
+    assert calls == 1
+    assert [result for result, _ in results] == ["rows"] * 5
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert len(flights) == 0
+
+
+def test_different_keys_run_separately():
+    flights = SingleFlight()
+
+    async def main():
+        return await asyncio.gather(flights.do("a", lambda: asyncio.sleep(0, "a")), flights.do("b", lambda: asyncio.sleep(0, "b")))
+
+    assert asyncio.run(main()) == [("a", False), ("b", False)]
+
+
+def test_calls_after_a_run_finished_start_a_new_one():
+    flights = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    async def main():
+        first = await flights.do("key", work)
+        second = await flights.do("key", work)
+        return first, second
+
+    assert asyncio.run(main()) == ((1, False), (2, False))
+
+
+def test_every_caller_gets_the_exception():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("no data")
+
+    async def main():
+        return await asyncio.gather(flights.do("key", fail), flights.do("key", fail), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_run():
+    flights = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "rows"
+
+    async def main():
+        first = asyncio.create_task(flights.do("key", work))
+        second = asyncio.create_task(flights.do("key", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == ("rows", True)
@@ -0,0 +1,91 @@
+import pytest
+
+from app.utils.sql_validation import find_disallowed_statement, parse_sql, validate_references
+
+COLUMN_INDEX = {
+    "customers": {"id", "customer_name", "city"},
+    "sales": {"id", "customer_id", "product_name", "amount", "sale_date"},
+}
+
+
+def check(query, dialect_name=None):
+    return validate_references(parse_sql(query, dialect_name), COLUMN_INDEX)
+
+
+def test_parse_sql_reports_syntax_errors():
+    with pytest.raises(ValueError, match="SQL syntax error"):
+        parse_sql("SELECT FROM WHERE (")
+
+
+def test_parse_sql_rejects_several_statements():
+    with pytest.raises(ValueError, match="exactly one SQL statement"):
+        parse_sql("SELECT 1; SELECT 2")
+
+
+def test_find_disallowed_statement():
+    assert find_disallowed_statement(parse_sql("SELECT * FROM sales")) is None
+    assert find_disallowed_statement(parse_sql("DROP TABLE sales")) == "DROP"
+    assert find_disallowed_statement(parse_sql("DELETE FROM sales")) == "DELETE"
+
+
+def test_valid_query():
+    query = """
+        SELECT c.customer_name, SUM(s.amount) AS total
+        FROM sales s JOIN customers c ON c.id = s.customer_id
+        GROUP BY c.customer_name
+        ORDER BY total DESC
+    """
+    assert check(query) is None
+
+
+def test_unknown_table_with_suggestion():
+    error = check("SELECT amount FROM sale")
+    assert "Table 'sale' does not exist." in error
+    assert "Did you mean 'sales'?" in error
+
+
+def test_cte_is_not_an_unknown_table():
+    query = "WITH totals AS (SELECT customer_id, SUM(amount) AS total FROM sales GROUP BY customer_id) SELECT total FROM totals"
+    assert check(query) is None
+
+
+def test_unknown_column_with_suggestion():
+    error = check("SELECT product, amount FROM sales")
+    assert "Column 'product' does not exist in sales." in error
+    assert "Did you mean 'product_name'?" in error
+
+
+def test_unknown_qualified_column():
+    error = check("SELECT c.name FROM customers c")
+    assert "Column 'name' does not exist in 'c'." in error
+
+
+def test_unknown_alias():
+    error = check("SELECT x.amount FROM sales s")
+    assert "Unknown table or alias 'x'" in error
+
+
+def test_ambiguous_column():
+    error = check("SELECT id FROM sales JOIN customers ON customers.id = sales.customer_id")
+    assert "Column 'id' is ambiguous, it exists in customers, sales." in error
+
+
+def test_qualified_column_is_not_ambiguous():
+    assert check("SELECT sales.id FROM sales JOIN customers ON customers.id = sales.customer_id") is None
+
+
+def test_select_alias_in_order_by():
+    assert check("SELECT SUM(amount) AS total FROM sales ORDER BY total") is None
+
+
+def test_correlated_subquery():
+    query = """
+        SELECT customer_name FROM customers c
+        WHERE EXISTS (SELECT 1 FROM sales s WHERE s.customer_id = c.id AND s.amount > 100)
+    """
+    assert check(query) is None
+
+
+def test_dialect_specific_syntax():
+    assert check("SELECT amount::int FROM sales", "postgresql") is None
+    assert check("SELECT `amount` FROM `sales`", "mysql") is None
@@ -0,0 +1,31 @@
+from app.utils.visualization_utils import classify_chart_type
+
+
+def test_identifier_next_to_a_label_is_not_a_second_category():
+    customers = [
+        {"customer_id": 1, "customer_name": "Ann", "total_sales": 120.5},
+        {"customer_id": 2, "customer_name": "Bob", "total_sales": 80.0},
+        {"customer_id": 3, "customer_name": "Cid", "total_sales": 42.0},
+    ]
+    products = [
+        {"product_id": 10, "product_name": "Desk", "total": 7},
+        {"product_id": 11, "product_name": "Lamp", "total": 3},
+    ]
+
+    assert classify_chart_type(customers, "Total sales per customer") == ("bar", 0.8)
+    assert classify_chart_type(products, "Units sold per product") == ("bar", 0.8)
+
+
+def test_identifier_without_a_label_is_the_category():
+    rows = [{"customer_id": 1, "total": 5}, {"customer_id": 2, "total": 9}]
+
+    assert classify_chart_type(rows, "Total per customer") == ("bar", 0.8)
+
+
+def test_two_labels_and_a_measure_are_a_heatmap():
+    rows = [
+        {"region": "North", "product": "Desk", "sales": 3},
+        {"region": "South", "product": "Lamp", "sales": 4},
+    ]
+
+    assert classify_chart_type(rows, "Sales by region and product") == ("heatmap", 0.7)